@@ -1,10 +1,12 @@
 from fastapi import APIRouter, HTTPException, Query
-from psycopg2.extras import RealDictCursor
 import os
+import asyncio
 
-from app.db import get_conn
+from app.db import transaction
 from .schemas import LoginRequest, TokenResponse
 from .auth_utils import verify_password, create_access_token, hash_password
+from .dependencies import invalidate_user
+from app.routing import routing_table
 
 router = APIRouter(prefix="/api/auth", tags=["Auth"])
 
@@ -13,16 +15,11 @@ SEED_SECRET = os.getenv("SEED_SECRET", "seed-local")
 
 @router.post("/login", response_model=TokenResponse)
 async def login(payload: LoginRequest):
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    cur.execute(
-        "SELECT id, email, password_hash, is_active FROM users WHERE email=%s LIMIT 1",
-        (payload.email.lower().strip(),)
-    )
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    async with transaction() as tx:
+        user = await tx.fetchone(
+            "SELECT id, email, password_hash, is_active FROM users WHERE email=%s LIMIT 1",
+            (payload.email.lower().strip(),)
+        )
 
     # usuário inexistente ou inativo
     if not user or not user.get("is_active"):
@@ -30,7 +27,8 @@ async def login(payload: LoginRequest):
 
     # hash inválido / antigo (bcrypt etc) -> não deixa dar 500
     try:
-        ok = verify_password(payload.password, user["password_hash"])
+        # PBKDF2 é CPU-bound: roda fora do event loop
+        ok = await asyncio.to_thread(verify_password, payload.password, user["password_hash"])
     except Exception:
         raise HTTPException(status_code=401, detail="Email ou senha inválidos")
 
@@ -58,39 +56,35 @@ async def seed_admin(
         raise HTTPException(status_code=403, detail="Secret inválido")
 
     email_clean = email.lower().strip()
-    pwd_hash = hash_password(password)
-
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-
-    # existe?
-    cur.execute("SELECT id FROM users WHERE email=%s", (email_clean,))
-    row = cur.fetchone()
-
-    if row:
-        cur.execute("""
-            UPDATE users
-            SET name=%s,
-                password_hash=%s,
-                role='admin',
-                is_active=true,
-                phone_number_id = COALESCE(%s, phone_number_id)
-            WHERE email=%s
-            RETURNING id
-        """, (name, pwd_hash, phone_number_id, email_clean))
-        user_id = cur.fetchone()["id"]
-        status = "updated"
-    else:
-        cur.execute("""
-            INSERT INTO users (name, email, password_hash, role, is_active, phone_number_id)
-            VALUES (%s, %s, %s, 'admin', true, %s)
-            RETURNING id
-        """, (name, email_clean, pwd_hash, phone_number_id))
-        user_id = cur.fetchone()["id"]
-        status = "created"
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    pwd_hash = await asyncio.to_thread(hash_password, password)
+
+    async with transaction() as tx:
+        # existe?
+        row = await tx.fetchone("SELECT id FROM users WHERE email=%s", (email_clean,))
+
+        if row:
+            row = await tx.fetchone("""
+                UPDATE users
+                SET name=%s,
+                    password_hash=%s,
+                    role='admin',
+                    is_active=true,
+                    phone_number_id = COALESCE(%s, phone_number_id)
+                WHERE email=%s
+                RETURNING id
+            """, (name, pwd_hash, phone_number_id, email_clean))
+            user_id = row["id"]
+            status = "updated"
+        else:
+            row = await tx.fetchone("""
+                INSERT INTO users (name, email, password_hash, role, is_active, phone_number_id)
+                VALUES (%s, %s, %s, 'admin', true, %s)
+                RETURNING id
+            """, (name, email_clean, pwd_hash, phone_number_id))
+            user_id = row["id"]
+            status = "created"
+
+    invalidate_user(user_id)
+    routing_table.invalidate()
 
     return {"status": status, "user_id": str(user_id), "email": email_clean, "password": password}
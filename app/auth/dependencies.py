@@ -2,15 +2,27 @@ import os
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt, JWTError
-from psycopg2.extras import RealDictCursor
-
-from app.db import get_conn
+from app.db import transaction
+from app.cache import TTLCache
 
 SECRET_KEY = os.getenv("JWT_SECRET", "dev-secret-local")
 ALGORITHM = "HS256"
 security = HTTPBearer()
 
-def get_current_user(creds: HTTPAuthorizationCredentials = Depends(security)):
+# Cache dos usuários autenticados (evita 1 query por request no polling do painel).
+# TTL curto: mudanças feitas por outro processo aparecem em até USER_CACHE_TTL segundos.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def invalidate_user(user_id):
+    """Chamar sempre que o usuário for alterado (senha, is_active, phone_number_id...)."""
+    _user_cache.invalidate(str(user_id))
+
+
+async def get_current_user(creds: HTTPAuthorizationCredentials = Depends(security)):
     token = creds.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -20,14 +32,23 @@ def get_current_user(creds: HTTPAuthorizationCredentials = Depends(security)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
-    conn = get_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT id, email, role, phone_number_id, is_active FROM users WHERE id=%s", (user_id,))
-    user = cur.fetchone()
-    cur.close()
-    conn.close()
+    user = _user_cache.get(str(user_id))
+    if user is None:
+        async with transaction() as tx:
+            user = await tx.fetchone(
+                "SELECT id, email, role, phone_number_id, is_active FROM users WHERE id=%s",
+                (user_id,),
+            )
+
+        if not user or not user.get("is_active"):
+            raise HTTPException(status_code=401, detail="Usuário inativo ou inexistente")
+
+        _user_cache.set(str(user_id), dict(user))
+
+    return dict(user)
 
-    if not user or not user.get("is_active"):
-        raise HTTPException(status_code=401, detail="Usuário inativo ou inexistente")
 
+async def get_admin_user(user=Depends(get_current_user)):
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Acesso restrito a administradores")
     return user
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Set, Tuple
+
+from . import metrics
+from .db import transaction
+from .events import publish
+from .statuses import CAMPAIGN_PROGRESS_COLUMNS, apply_status_backlog, lock_status_keys, resolve_unknown_items
+
+# Grava resultados da campanha em lote: a cada N itens ou a cada X segundos
+CAMPAIGN_FLUSH_SIZE = int(os.getenv("CAMPAIGN_FLUSH_SIZE", "200"))
+CAMPAIGN_FLUSH_INTERVAL = float(os.getenv("CAMPAIGN_FLUSH_INTERVAL", "1.0"))
+
+logger = logging.getLogger(__name__)
+
+# buffers ativos, para o shutdown conseguir descarregar tudo
+_active: Set["CampaignResultBuffer"] = set()
+
+
+class CampaignResultBuffer:
+    """
+    Write-behind dos resultados de envio (campaign_items + contadores da campanha).
+
+        async with CampaignResultBuffer(campaign_id, worker_id) as results:
+            await results.add(item_id, meta_id, None)          # enviado
+            await results.add(item_id, None, "erro ...")        # falhou
+            await results.add_unknown(item_id, "timeout ...")  # incerto: aguarda o status da Meta
+
+    Cada flush é UMA transação: um UPDATE ... FROM unnest(...) nos itens
+    e um UPDATE nos contadores da campanha.
+
+    Só grava itens ainda alugados por `worker_id`: se o aluguel venceu e o item
+    foi retomado (ou dado como falho), o resultado atrasado é descartado.
+    """
+
+    def __init__(
+        self,
+        campaign_id,
+        worker_id: str,
+        flush_size: int = CAMPAIGN_FLUSH_SIZE,
+        flush_interval: float = CAMPAIGN_FLUSH_INTERVAL,
+    ):
+        self.campaign_id = campaign_id
+        self.worker_id = worker_id
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self._pending: List[Tuple[object, str, Optional[str], Optional[str]]] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        _active.add(self)
+        self._timer = asyncio.create_task(self._periodic_flush())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if self._timer:
+                self._timer.cancel()
+            # shield: mesmo se a task for cancelada (shutdown), o que está no buffer vai pro banco
+            await asyncio.shield(self.flush())
+        finally:
+            _active.discard(self)
+
+    async def add(self, item_id, meta_id: Optional[str] = None, error_message: Optional[str] = None):
+        status = "sent" if error_message is None else "failed"
+        await self._add(item_id, status, error_message, meta_id)
+
+    async def add_unknown(self, item_id, error_message: str):
+        """Envio que pode ter saído (timeout, worker que caiu): fica 'unknown' até o status da Meta."""
+        await self._add(item_id, "unknown", error_message, None)
+
+    async def _add(self, item_id, status: str, error_message: Optional[str], meta_id: Optional[str]):
+        self._pending.append((item_id, status, error_message, meta_id))
+        if len(self._pending) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+
+            try:
+                await _write_batch(self.campaign_id, self.worker_id, batch)
+            except BaseException:
+                # devolve para o buffer: tenta de novo no próximo flush
+                self._pending = batch + self._pending
+                raise
+
+    async def _periodic_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # erro transitório de banco: os itens continuam no buffer
+                logger.exception("Falha ao gravar resultados da campanha %s", self.campaign_id)
+
+
+async def _write_batch(campaign_id, worker_id: str, batch):
+    ids = [str(item_id) for item_id, _, _, _ in batch]
+    statuses = [status for _, status, _, _ in batch]
+    errors = [error for _, _, error, _ in batch]
+    meta_ids = [meta_id for _, _, _, meta_id in batch]
+    unknown_ids = [item_id for item_id, status in zip(ids, statuses) if status == "unknown"]
+
+    async with transaction() as tx:
+        # antes de gravar os ids (e os itens 'unknown', achados pelo callback_data):
+        # um webhook de status simultâneo espera este commit
+        await lock_status_keys(tx, meta_ids + unknown_ids)
+
+        # só itens ainda deste worker: contadores saem das linhas realmente gravadas
+        rows = await tx.fetchall("""
+            UPDATE campaign_items AS ci
+            SET status = v.status,
+                error_message = v.error_message,
+                meta_message_id = v.meta_message_id,
+                unknown_since = CASE WHEN v.status = 'unknown' THEN NOW() END,
+                locked_by = NULL,
+                locked_until = NULL
+            FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::text[]) AS v(id, status, error_message, meta_message_id)
+            WHERE ci.id = v.id
+              AND ci.locked_by = %s
+              AND ci.status = 'processing'
+            RETURNING ci.status, ci.meta_message_id
+        """, (ids, statuses, errors, meta_ids, worker_id))
+
+        if len(rows) < len(batch):
+            logger.warning(
+                "Campanha %s: %d resultados descartados (aluguel vencido: item retomado ou dado como falho)",
+                campaign_id, len(batch) - len(rows),
+            )
+        if not rows:
+            return
+
+        sent = sum(1 for row in rows if row["status"] == "sent")
+        failed = sum(1 for row in rows if row["status"] == "failed")
+
+        camp = await tx.fetchone(f"""
+            UPDATE campaigns
+            SET sent = sent + %s, failed = failed + %s
+            WHERE id = %s
+            RETURNING {CAMPAIGN_PROGRESS_COLUMNS}
+        """, (sent, failed, campaign_id))
+        if camp:
+            publish(tx, camp["user_id"], "campaign.progress", camp)
+
+        tx.on_commit(lambda: _count_results(sent, failed))
+
+        # status de entrega que chegaram antes deste flush
+        await apply_status_backlog(tx, [row["meta_message_id"] for row in rows])
+        if unknown_ids:
+            await resolve_unknown_items(tx, unknown_ids)
+
+
+def _count_results(sent: int, failed: int):
+    metrics.CAMPAIGN_MESSAGES.labels("sent").inc(sent)
+    metrics.CAMPAIGN_MESSAGES.labels("failed").inc(failed)
+
+
+async def flush_all_results():
+    """Descarrega todos os buffers ativos (chamado no shutdown)."""
+    for buffer in list(_active):
+        try:
+            await buffer.flush()
+        except Exception:
+            logger.exception("Resultados da campanha %s não foram gravados", buffer.campaign_id)
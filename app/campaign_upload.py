@@ -0,0 +1,142 @@
+"""
+Upload da lista de contatos de uma campanha (CSV).
+
+Formato: uma linha por contato. A coluna do número é a que tiver cabeçalho
+to/phone/telefone/numero/celular/whatsapp (ou a primeira); as demais colunas,
+na ordem, viram os parâmetros do template daquele contato ({{1}}, {{2}}...).
+Separador , ; ou TAB (detectado). Cabeçalho opcional: a primeira linha só é
+tratada como cabeçalho se tiver um dos nomes acima ou texto (letras) e nenhum
+dígito na coluna do número; "123" na primeira linha é um número inválido (vai
+para os erros), não um cabeçalho.
+
+O arquivo é lido em blocos de CAMPAIGN_UPLOAD_CHUNK linhas e cada bloco vai por
+COPY para uma tabela temporária; a remoção de duplicados é feita no final pelo
+próprio Postgres (DISTINCT ON), então a memória do processo não cresce com o
+tamanho da lista.
+"""
+import asyncio
+import csv
+import io
+import os
+from typing import List, Optional, Tuple
+
+from .phone_numbers import normalize_e164
+
+CAMPAIGN_UPLOAD_CHUNK = int(os.getenv("CAMPAIGN_UPLOAD_CHUNK", "5000"))
+CAMPAIGN_UPLOAD_MAX_ERRORS = int(os.getenv("CAMPAIGN_UPLOAD_MAX_ERRORS", "20"))  # linhas inválidas listadas na resposta
+
+_NUMBER_HEADERS = {"to", "phone", "telefone", "numero", "número", "celular", "whatsapp", "wa_id"}
+
+
+class _CsvSource:
+    """Leitor do CSV (síncrono: cada bloco é lido numa thread)."""
+
+    def __init__(self, binary_file):
+        self.text = io.TextIOWrapper(binary_file, encoding="utf-8-sig", errors="replace", newline="")
+        sample = self.text.read(4096)
+        self.text.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        self.reader = csv.reader(self.text, dialect)
+        self.number_col = 0
+        self.pending: List[Tuple[int, list]] = []
+        self._read_header()
+
+    def _read_header(self):
+        first = next(self.reader, None)
+        if first is None:
+            return
+        names = [c.strip().lower() for c in first]
+        for i, name in enumerate(names):
+            if name in _NUMBER_HEADERS:
+                self.number_col = i
+                return
+        number = first[0] if first else ""
+        if (not any(ch.isdigit() for ch in number)
+                and any(ch.isalpha() for c in first for ch in c)):
+            return  # cabeçalho com outros nomes: número na primeira coluna
+        # sem cabeçalho; se o número for inválido a linha entra nos erros como as outras
+        self.pending.append((self.reader.line_num, first))
+
+    def read_chunk(self, n: int) -> List[Tuple[int, list]]:
+        chunk, self.pending = self.pending, []
+        for row in self.reader:
+            chunk.append((self.reader.line_num, row))
+            if len(chunk) >= n:
+                break
+        return chunk
+
+
+def _pg_text_array(values: List[str]) -> str:
+    """Literal de text[] do Postgres (serve para os dois formatos de COPY)."""
+    quoted = ('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+    return "{" + ",".join(quoted) + "}"
+
+
+async def import_contacts(tx, campaign_id, binary_file, with_params: bool) -> dict:
+    """
+    Lê o CSV e insere os itens da campanha (dentro da transação `tx`).
+    Retorna {"total", "rows", "invalid", "duplicates", "errors"}.
+    """
+    await tx.execute("""
+        CREATE TEMP TABLE campaign_upload (
+            seq bigint NOT NULL,
+            "to" text NOT NULL,
+            params text[]
+        ) ON COMMIT DROP
+    """)
+
+    source = await asyncio.to_thread(_CsvSource, binary_file)
+    rows = invalid = 0
+    errors = []
+
+    while True:
+        chunk = await asyncio.to_thread(source.read_chunk, CAMPAIGN_UPLOAD_CHUNK)
+        if not chunk:
+            break
+
+        batch = []
+        for line, cells in chunk:
+            if not any(c.strip() for c in cells):
+                continue  # linha em branco
+            rows += 1
+
+            raw = cells[source.number_col] if source.number_col < len(cells) else ""
+            num = normalize_e164(raw)
+            if num is None:
+                invalid += 1
+                if len(errors) < CAMPAIGN_UPLOAD_MAX_ERRORS:
+                    errors.append({"line": line, "value": raw[:50], "error": "Número inválido (E.164)"})
+                continue
+
+            params: Optional[str] = None
+            if with_params:
+                extra = [c.strip() for i, c in enumerate(cells) if i != source.number_col]
+                if any(extra):
+                    params = _pg_text_array(extra)
+            batch.append((line, num, params))
+
+        if batch:
+            await tx.copy_rows("campaign_upload", ("seq", '"to"', "params"), batch)
+
+    # primeira ocorrência de cada número, na ordem do arquivo
+    total = await tx.execute("""
+        INSERT INTO campaign_items (campaign_id, "to", status, params)
+        SELECT %s, u."to", 'pending', u.params
+        FROM (
+            SELECT DISTINCT ON ("to") "to", params, seq
+            FROM campaign_upload
+            ORDER BY "to", seq
+        ) AS u
+        ORDER BY u.seq
+    """, (campaign_id,))
+
+    return {
+        "total": total,
+        "rows": rows,
+        "invalid": invalid,
+        "duplicates": rows - invalid - total,
+        "errors": errors,
+    }
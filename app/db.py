@@ -1,8 +1,30 @@
+import io
+import csv
 import os
+import time
+import asyncio
+import threading
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+from . import metrics, profiling
+
+try:
+    from psycopg import AsyncConnection
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # psycopg 3 é opcional no modo "sync"
+    AsyncConnection = None
+    dict_row = None
+    AsyncConnectionPool = None
+
 load_dotenv()
 
 DATABASE_URL_RAW = os.getenv("DATABASE_URL")
@@ -17,11 +39,519 @@ if "sslmode=" in DATABASE_URL_RAW:
 else:
     DATABASE_URL = DATABASE_URL_RAW
 
+# Pool de conexões (valores em segundos quando for tempo)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))            # espera por conexão livre
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))         # fecha conexões ociosas acima do mínimo
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recicla conexões antigas
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))    # testa (SELECT 1) se ficou parada mais que isso
+
+# "async": driver assíncrono (psycopg 3 + AsyncConnectionPool)
+# "sync":  psycopg2 + ConnectionPool, com cada chamada rodando numa thread
+DB_MODE = os.getenv("DB_MODE", "async").strip().lower()
+
+
+class PoolTimeout(RuntimeError):
+    pass
 
-def get_conn():
+
+def _connect():
     # força um sslmode válido aqui
     return psycopg2.connect(
         DATABASE_URL,
         sslmode="require",      # se der problema, pode testar "prefer"
         cursor_factory=RealDictCursor,
     )
+
+
+class ConnectionPool:
+    """
+    Pool de conexões psycopg2 thread-safe.
+
+    - abre até `maxconn` conexões; quem passar disso espera até `timeout`
+    - reaproveita a conexão usada mais recentemente (LIFO)
+    - faz health check em conexões que ficaram paradas
+    - fecha conexões ociosas (acima de `minconn`) e conexões muito antigas
+    """
+
+    def __init__(
+        self,
+        minconn: int = DB_POOL_MIN,
+        maxconn: int = DB_POOL_MAX,
+        timeout: float = DB_POOL_TIMEOUT,
+        max_idle: float = DB_POOL_MAX_IDLE,
+        max_lifetime: float = DB_POOL_MAX_LIFETIME,
+        check_after: float = DB_POOL_CHECK_AFTER,
+    ):
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+
+        self._idle = deque()      # (conn, last_used)
+        self._created = {}        # id(conn) -> criado em
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._closed = False
+
+    def open(self):
+        """Abre as `minconn` conexões iniciais."""
+        for _ in range(self.minconn - len(self._idle)):
+            conn = self._new_conn()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+
+    @property
+    def size(self) -> int:
+        return len(self._created)
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def getconn(self):
+        if self._closed:
+            raise RuntimeError("Pool de conexões fechado")
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"Nenhuma conexão livre no pool após {self.timeout}s")
+
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.pop() if self._idle else None
+
+                if entry is None:
+                    return self._new_conn()
+
+                conn, last_used = entry
+                now = time.monotonic()
+
+                if conn.closed or self._too_old(conn, now):
+                    self._discard(conn)
+                    continue
+
+                if now - last_used > self.check_after and not self._is_healthy(conn):
+                    self._discard(conn)
+                    continue
+
+                return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, close: bool = False):
+        try:
+            if not close and not conn.closed:
+                # devolve sempre "limpa", sem transação aberta
+                try:
+                    if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+            now = time.monotonic()
+            if close or conn.closed or self._closed or self._too_old(conn, now):
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, now))
+                self._prune_idle(now)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._closed = True
+        with self._lock:
+            entries = list(self._idle)
+            self._idle.clear()
+        for conn, _ in entries:
+            self._discard(conn)
+
+    # ---------- internos ----------
+
+    def _new_conn(self):
+        conn = _connect()
+        with self._lock:
+            self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _too_old(self, conn, now: float) -> bool:
+        created = self._created.get(id(conn), now)
+        return now - created > self.max_lifetime
+
+    def _is_healthy(self, conn) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prune_idle(self, now: float):
+        # as mais antigas ficam no início da fila (LIFO usa o fim)
+        expired = []
+        with self._lock:
+            while len(self._created) - len(expired) > self.minconn and self._idle:
+                conn, last_used = self._idle[0]
+                if now - last_used <= self.max_idle:
+                    break
+                self._idle.popleft()
+                expired.append(conn)
+        for conn in expired:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# transaction() no modo sync: a espera por conexão livre fica no event loop.
+# Esperar dentro de pool.getconn prende threads do executor, e as transações
+# abertas ficam sem thread para terminar (trava até o DB_POOL_TIMEOUT).
+_tx_slots: Optional[asyncio.Semaphore] = None
+_tx_waiting = 0
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def open_pool():
+    get_pool().open()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+# =======================
+# CAMADA ASSÍNCRONA
+# =======================
+
+class _CommitHooks:
+    def before_commit(self, callback):
+        """Agenda `await callback(tx)` para o fim do bloco, ainda dentro da transação."""
+        self._before_commit.append(callback)
+
+    def on_commit(self, callback):
+        """Agenda `callback()` para rodar só depois do COMMIT (ex: publicar eventos)."""
+        self._after_commit.append(callback)
+
+    async def _run_before_commit_hooks(self):
+        for callback in self._before_commit:
+            await callback(self)
+
+    def _run_commit_hooks(self):
+        for callback in self._after_commit:
+            callback()
+
+
+class _SlowQueryLog:
+    """Log de queries lentas (app/profiling.py), igual nos dois modos; cada Tx fornece `_query`."""
+
+    async def _trace_slow(self, sql, params, elapsed, rows):
+        plan = None
+        explain = profiling.explain_sql(sql)
+        if explain:
+            # savepoint: um EXPLAIN com erro não pode abortar a transação
+            await self._query("SAVEPOINT slow_query_explain")
+            try:
+                plan = profiling.plan_lines(await self._query(explain, params))
+                await self._query("RELEASE SAVEPOINT slow_query_explain")
+            except Exception as e:
+                await self._query("ROLLBACK TO SAVEPOINT slow_query_explain")
+                plan = [f"(EXPLAIN falhou: {e})"]
+        profiling.log_slow_query(sql, params, elapsed, rows, plan)
+
+
+class AsyncTx(_SlowQueryLog, _CommitHooks):
+    """Transação sobre uma conexão psycopg 3 assíncrona."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._before_commit = []
+        self._after_commit = []
+
+    async def _run(self, sql, params, fetch):
+        start = time.perf_counter()
+        async with self.conn.cursor() as cur:
+            try:
+                await cur.execute(sql, params)
+                if fetch == "one":
+                    result = await cur.fetchone()
+                elif fetch == "all":
+                    result = await cur.fetchall()
+                else:
+                    result = cur.rowcount
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.observe_query(sql, elapsed)
+            rows = cur.rowcount
+        if profiling.is_slow(elapsed):
+            await self._trace_slow(sql, params, elapsed, rows)
+        return result
+
+    async def _query(self, sql, params=None):
+        # sem métricas nem log (usado pelo próprio log de queries lentas)
+        async with self.conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall() if cur.description else None
+
+    async def execute(self, sql: str, params=None) -> int:
+        return await self._run(sql, params, None)
+
+    async def fetchone(self, sql: str, params=None):
+        return await self._run(sql, params, "one")
+
+    async def fetchall(self, sql: str, params=None):
+        return await self._run(sql, params, "all")
+
+    async def copy_rows(self, table: str, columns, rows) -> int:
+        """COPY ... FROM STDIN das tuplas em `rows`. Retorna quantas linhas foram enviadas."""
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+        start = time.perf_counter()
+        n = 0
+        async with self.conn.cursor() as cur:
+            async with cur.copy(sql) as copy:
+                for row in rows:
+                    await copy.write_row(row)
+                    n += 1
+        metrics.observe_query(sql, time.perf_counter() - start)
+        return n
+
+    async def stream(self, sql: str, params=None, batch_size: int = 1000):
+        """Lê o resultado em lotes por um cursor no servidor (memória constante)."""
+        async with self.conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+            await cur.execute(sql, params)
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
+class ThreadedTx(_SlowQueryLog, _CommitHooks):
+    """Mesma interface do AsyncTx, mas com psycopg2 rodando no threadpool."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._before_commit = []
+        self._after_commit = []
+
+    def _run_sync(self, sql, params, fetch):
+        # roda no threadpool; o tempo é medido aqui (sem a espera pelo executor)
+        start = time.perf_counter()
+        cur = self.conn.cursor()
+        try:
+            try:
+                cur.execute(sql, params)
+                if fetch == "one":
+                    result = cur.fetchone()
+                elif fetch == "all":
+                    result = cur.fetchall()
+                else:
+                    result = cur.rowcount
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.observe_query(sql, elapsed)
+            return result, elapsed, cur.rowcount
+        finally:
+            cur.close()
+
+    async def _run(self, sql, params, fetch):
+        result, elapsed, rows = await asyncio.to_thread(self._run_sync, sql, params, fetch)
+        if profiling.is_slow(elapsed):
+            await self._trace_slow(sql, params, elapsed, rows)
+        return result
+
+    def _query_sync(self, sql, params):
+        cur = self.conn.cursor()
+        try:
+            cur.execute(sql, params)
+            return cur.fetchall() if cur.description else None
+        finally:
+            cur.close()
+
+    async def _query(self, sql, params=None):
+        # sem métricas nem log (usado pelo próprio log de queries lentas)
+        return await asyncio.to_thread(self._query_sync, sql, params)
+
+    async def execute(self, sql: str, params=None) -> int:
+        return await self._run(sql, params, None)
+
+    async def fetchone(self, sql: str, params=None):
+        return await self._run(sql, params, "one")
+
+    async def fetchall(self, sql: str, params=None):
+        return await self._run(sql, params, "all")
+
+    def _copy(self, table, columns, rows):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        n = 0
+        for row in rows:
+            writer.writerow(["\\N" if v is None else v for v in row])
+            n += 1
+        buf.seek(0)
+
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        start = time.perf_counter()
+        cur = self.conn.cursor()
+        try:
+            cur.copy_expert(sql, buf)
+        finally:
+            cur.close()
+        metrics.observe_query(sql, time.perf_counter() - start)
+        return n
+
+    async def copy_rows(self, table: str, columns, rows) -> int:
+        return await asyncio.to_thread(self._copy, table, columns, rows)
+
+    async def stream(self, sql: str, params=None, batch_size: int = 1000):
+        """Lê o resultado em lotes por um cursor nomeado (memória constante)."""
+        cur = self.conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        try:
+            await asyncio.to_thread(cur.execute, sql, params)
+            while True:
+                rows = await asyncio.to_thread(cur.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await asyncio.to_thread(cur.close)
+
+
+_async_pool = None
+
+
+def get_async_pool():
+    global _async_pool
+    if _async_pool is None:
+        if AsyncConnectionPool is None:
+            raise RuntimeError("DB_MODE=async requer psycopg[binary,pool] instalado (ou use DB_MODE=sync)")
+        _async_pool = AsyncConnectionPool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            check=AsyncConnectionPool.check_connection,
+            kwargs={"sslmode": "require", "row_factory": dict_row},
+            open=False,
+        )
+    return _async_pool
+
+
+def pool_stats() -> dict:
+    """Conexões do pool do modo configurado: em uso, livres e pedidos esperando."""
+    if DB_MODE == "sync":
+        if _pool is None:
+            return {"in_use": 0, "idle": 0, "waiting": 0}
+        size, idle = _pool.size, _pool.idle
+        return {"in_use": size - idle, "idle": idle, "waiting": _tx_waiting}
+
+    if _async_pool is None:
+        return {"in_use": 0, "idle": 0, "waiting": 0}
+    stats = _async_pool.get_stats()
+    size, idle = stats.get("pool_size", 0), stats.get("pool_available", 0)
+    return {"in_use": size - idle, "idle": idle, "waiting": stats.get("requests_waiting", 0)}
+
+
+async def connect_listener():
+    """Conexão dedicada (fora do pool, autocommit) para LISTEN/NOTIFY."""
+    if AsyncConnection is None:
+        raise RuntimeError("LISTEN/NOTIFY requer psycopg[binary,pool] instalado")
+    return await AsyncConnection.connect(DATABASE_URL, autocommit=True, sslmode="require")
+
+
+async def open_db():
+    """Abre o pool do modo configurado (chamado no startup do app/worker)."""
+    if DB_MODE == "sync":
+        await asyncio.to_thread(open_pool)
+    else:
+        await get_async_pool().open()
+
+
+async def close_db():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+    await asyncio.to_thread(close_pool)
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Abre uma transação sem bloquear o event loop:
+
+        async with transaction() as tx:
+            row = await tx.fetchone("SELECT ...", (...,))
+            await tx.execute("UPDATE ...", (...,))
+
+    Commit no final do bloco, rollback se der exceção.
+    """
+    wait_start = time.perf_counter()
+    if DB_MODE == "sync":
+        global _tx_slots, _tx_waiting
+        if _tx_slots is None:
+            _tx_slots = asyncio.Semaphore(DB_POOL_MAX)
+        _tx_waiting += 1
+        try:
+            await asyncio.wait_for(_tx_slots.acquire(), DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"Nenhuma conexão livre no pool após {DB_POOL_TIMEOUT}s")
+        finally:
+            _tx_waiting -= 1
+
+        try:
+            pool = get_pool()
+            conn = await asyncio.to_thread(pool.getconn)
+            metrics.observe_pool_wait(time.perf_counter() - wait_start)
+            broken = False
+            tx = ThreadedTx(conn)
+            try:
+                yield tx
+                await tx._run_before_commit_hooks()
+                await asyncio.to_thread(conn.commit)
+            except BaseException:
+                try:
+                    await asyncio.to_thread(conn.rollback)
+                except psycopg2.Error:
+                    broken = True
+                raise
+            finally:
+                await asyncio.to_thread(pool.putconn, conn, broken)
+        finally:
+            _tx_slots.release()
+    else:
+        async with get_async_pool().connection() as conn:
+            metrics.observe_pool_wait(time.perf_counter() - wait_start)
+            tx = AsyncTx(conn)
+            yield tx
+            await tx._run_before_commit_hooks()
+
+    tx._run_commit_hooks()
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from .meta_client import MetaSendError
+
+# Quantos envios simultâneos por campanha
+CAMPAIGN_CONCURRENCY = int(os.getenv("CAMPAIGN_CONCURRENCY", "10"))
+
+# Limite de envio por phone_number_id (a Meta libera 80 msg/s por padrão)
+META_MESSAGES_PER_SECOND = float(os.getenv("META_MESSAGES_PER_SECOND", "80"))
+META_BURST = int(os.getenv("META_BURST", "20"))
+
+# Backoff quando a Meta responde "rate limit" (429 / 130429)
+RATE_LIMIT_BACKOFF_INITIAL = float(os.getenv("RATE_LIMIT_BACKOFF_INITIAL", "1"))
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "60"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+
+# Retentativas de erros temporários (5xx, conexão): backoff exponencial com jitter
+META_SEND_MAX_RETRIES = int(os.getenv("META_SEND_MAX_RETRIES", "3"))
+META_RETRY_BACKOFF_INITIAL = float(os.getenv("META_RETRY_BACKOFF_INITIAL", "0.5"))
+META_RETRY_BACKOFF_MAX = float(os.getenv("META_RETRY_BACKOFF_MAX", "30"))
+
+# Circuit breaker por phone_number_id: taxa de erro alta pausa os envios
+CIRCUIT_WINDOW = int(os.getenv("CIRCUIT_WINDOW", "50"))            # últimos N envios
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "20"))      # mínimo para avaliar
+CIRCUIT_ERROR_RATE = float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))      # pausa inicial (dobra a cada teste que falha)
+CIRCUIT_COOLDOWN_MAX = float(os.getenv("CIRCUIT_COOLDOWN_MAX", "300"))
+CIRCUIT_PROBE_POLL = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket assíncrono com taxa adaptativa.
+
+    - `acquire()` espera até ter 1 token
+    - `penalize()` pausa o bucket e reduz a taxa pela metade (backoff exponencial)
+    - `reward()` recupera a taxa aos poucos depois de envios com sucesso
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = max(rate / 16, 0.5)
+        self.capacity = max(1, capacity)
+
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff = RATE_LIMIT_BACKOFF_INITIAL
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        wait = retry_after if retry_after else self._backoff
+        self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        self._backoff = min(self._backoff * 2, RATE_LIMIT_BACKOFF_MAX)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0
+
+    def reward(self):
+        self._backoff = RATE_LIMIT_BACKOFF_INITIAL
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def get_bucket(phone_number_id: str) -> TokenBucket:
+    """Um bucket por phone_number_id, compartilhado por todas as campanhas do processo."""
+    bucket = _buckets.get(phone_number_id)
+    if bucket is None:
+        bucket = TokenBucket(META_MESSAGES_PER_SECOND, META_BURST)
+        _buckets[phone_number_id] = bucket
+    return bucket
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um phone_number_id.
+
+    - fechado: envia normalmente e guarda o resultado dos últimos envios
+    - aberto: taxa de erro passou de CIRCUIT_ERROR_RATE; `wait()` segura os
+      envios até o fim da pausa
+    - meio-aberto: passada a pausa, um envio de teste por vez; sucesso fecha,
+      falha reabre com a pausa dobrada
+
+    Só contam como erro as falhas do lado da Meta (5xx, timeout, conexão).
+    Número inválido ou rate limit mostram que a API está respondendo.
+    """
+
+    def __init__(self, name: str, window: int = CIRCUIT_WINDOW, min_calls: int = CIRCUIT_MIN_CALLS,
+                 error_rate: float = CIRCUIT_ERROR_RATE, cooldown: float = CIRCUIT_COOLDOWN):
+        self.name = name
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.base_cooldown = cooldown
+
+        self._results: deque = deque(maxlen=max(window, self.min_calls))
+        self._cooldown = cooldown
+        self._open_until = 0.0   # 0 = fechado
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if not self._open_until:
+            return "closed"
+        return "open" if time.monotonic() < self._open_until else "half_open"
+
+    async def wait(self, block: bool = True):
+        """Espera o circuito liberar um envio (block=False: MetaSendError se estiver aberto)."""
+        while True:
+            if not self._open_until:
+                return
+            now = time.monotonic()
+            if now >= self._open_until and not self._probing:
+                self._probing = True  # este é o envio de teste
+                return
+            if not block:
+                raise MetaSendError(
+                    f"Envios pelo número {self.name} pausados: muitos erros da Meta",
+                    MetaSendError.RETRYABLE,
+                )
+            await asyncio.sleep(max(self._open_until - now, CIRCUIT_PROBE_POLL))
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        if self._open_until:
+            if now < self._open_until:
+                return  # resposta de envio que saiu antes de abrir
+            self._probing = False
+            if ok:
+                logger.info("Circuito do número %s fechado", self.name)
+                self._open_until = 0.0
+                self._cooldown = self.base_cooldown
+                self._results.clear()
+            else:
+                self._trip(now)
+            return
+
+        self._results.append(ok)
+        if len(self._results) >= self.min_calls:
+            failures = self._results.count(False)
+            if failures / len(self._results) >= self.error_rate:
+                self._trip(now)
+
+    def _trip(self, now: float):
+        logger.warning("Circuito do número %s aberto por %.0fs (erros da Meta)", self.name, self._cooldown)
+        self._open_until = now + self._cooldown
+        self._cooldown = min(self._cooldown * 2, CIRCUIT_COOLDOWN_MAX)
+        self._results.clear()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(phone_number_id: str) -> CircuitBreaker:
+    """Um circuit breaker por phone_number_id, compartilhado no processo (como os buckets)."""
+    breaker = _breakers.get(phone_number_id)
+    if breaker is None:
+        breaker = CircuitBreaker(phone_number_id)
+        _breakers[phone_number_id] = breaker
+    return breaker
+
+
+def backoff_delay(attempt: int) -> float:
+    """Backoff exponencial com "full jitter" (attempt começa em 1)."""
+    cap = min(META_RETRY_BACKOFF_MAX, META_RETRY_BACKOFF_INITIAL * 2 ** (attempt - 1))
+    return random.uniform(0, cap)
+
+
+async def send_with_retry(
+    send: Callable[[], Awaitable[Optional[str]]],
+    phone_number_id: str,
+    bucket: Optional[TokenBucket] = None,
+    block: bool = True,
+    max_retries: int = META_SEND_MAX_RETRIES,
+) -> Optional[str]:
+    """
+    Chama send() até dar certo, conforme o tipo do erro (MetaSendError.kind):
+
+    - rate_limit: pausa o bucket e tenta de novo (até RATE_LIMIT_MAX_RETRIES)
+    - retryable: backoff com jitter (até `max_retries`)
+    - ambiguous (timeout, 504): nunca repete, sobe na hora. A mensagem pode ter
+      saído e só o webhook de status (que pode demorar, ou estar na fila de
+      ingestão) confirma; quem chama decide o que fazer (o worker deixa o item
+      'unknown', ver statuses.resolve_unknown_items)
+    - permanent / outras exceções: sobe na hora
+
+    Retorna o meta_message_id.
+    """
+    breaker = get_breaker(phone_number_id)
+    attempts = rate_limited = 0
+
+    while True:
+        await breaker.wait(block)
+        if bucket is not None:
+            await bucket.acquire()
+
+        try:
+            meta_id = await send()
+        except MetaSendError as e:
+            breaker.record(e.kind not in (MetaSendError.RETRYABLE, MetaSendError.AMBIGUOUS))
+
+            if e.kind == MetaSendError.RATE_LIMIT and bucket is not None and rate_limited < RATE_LIMIT_MAX_RETRIES:
+                rate_limited += 1
+                bucket.penalize(e.retry_after)
+                continue
+            if e.kind != MetaSendError.RETRYABLE or attempts >= max_retries:
+                raise
+
+            attempts += 1
+            await asyncio.sleep(backoff_delay(attempts))
+            continue
+        except BaseException:
+            breaker.record(True)  # não diz nada sobre a Meta; libera o teste do meio-aberto
+            raise
+
+        breaker.record(True)
+        if bucket is not None:
+            bucket.reward()
+        return meta_id
+
+
+async def dispatch(
+    items: Iterable[dict],
+    send: Callable[[dict], Awaitable[Optional[str]]],
+    on_result: Callable[[dict, Optional[str], Optional[Exception]], Awaitable[None]],
+    phone_number_id: str,
+    concurrency: int = CAMPAIGN_CONCURRENCY,
+):
+    """
+    Envia `items` com `concurrency` workers, respeitando o bucket e o circuit
+    breaker do phone_number_id (ver send_with_retry).
+
+    - send(item) -> meta_message_id
+    - on_result(item, meta_message_id, error) é chamado uma vez por item
+      (error=None quando enviou; senão a exceção, ex: MetaSendError ambiguous)
+    """
+    bucket = get_bucket(phone_number_id)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    async def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                meta_id = await send_with_retry(lambda: send(item), phone_number_id, bucket=bucket)
+            except Exception as e:
+                await on_result(item, None, e)
+            else:
+                await on_result(item, meta_id, None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for w in workers:
+            w.cancel()
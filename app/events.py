@@ -0,0 +1,212 @@
+"""
+Eventos em tempo real para o painel (Server-Sent Events em /api/events).
+
+Tipos de evento (sempre do usuário dono):
+- message.new            mensagem nova (recebida ou enviada)
+- conversation.updated   última mensagem / não lidas mudaram
+- campaign.progress      contadores/status da campanha mudaram
+
+Quem grava no banco chama `publish(tx, user_id, tipo, dados)`: o evento só sai
+depois do COMMIT da transação.
+
+Backends (EVENTS_BACKEND):
+- postgres  NOTIFY no canal EVENTS_CHANNEL dentro da própria transação; cada
+            processo (web ou worker) escuta com LISTEN e repassa para as suas
+            conexões SSE. Funciona com vários workers/máquinas sem broker externo.
+- local     só dentro do processo (testes / um único processo web).
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Set
+from uuid import UUID
+
+from . import db
+
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "postgres").strip().lower()
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "painel_events")
+# eventos pendentes por conexão SSE; se encher, o cliente recebe "resync"
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "500"))
+
+# limite do payload do NOTIFY é 8000 bytes; acima disso manda só "resync"
+_NOTIFY_MAX_BYTES = 7900
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (UUID, Decimal)):
+        return str(value)
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
+
+
+def dumps(data) -> str:
+    return json.dumps(data, default=_json_default, separators=(",", ":"))
+
+
+class Subscription:
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # cliente lento: descarta e manda ele recarregar tudo
+            self.overflowed = True
+
+
+class EventBroker:
+    """Distribui eventos para as conexões SSE deste processo."""
+
+    def __init__(self):
+        self._subs: Dict[str, Set[Subscription]] = {}
+
+    @contextmanager
+    def subscribe(self, user_id):
+        sub = Subscription(str(user_id))
+        self._subs.setdefault(sub.user_id, set()).add(sub)
+        try:
+            yield sub
+        finally:
+            subs = self._subs.get(sub.user_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.user_id]
+
+    def publish_now(self, user_id, event_type: str, data):
+        self.deliver(user_id, event_type, dumps(data))
+
+    def deliver(self, user_id, event_type: str, data_json: str):
+        """Entrega um evento já serializado às conexões do usuário."""
+        subs = self._subs.get(str(user_id))
+        if not subs:
+            return
+        event = {"type": event_type, "data": data_json}
+        for sub in list(subs):
+            sub.push(event)
+
+    def resync_all(self):
+        """Pode ter perdido eventos (ex: LISTEN caiu): todo mundo recarrega."""
+        for subs in list(self._subs.values()):
+            for sub in list(subs):
+                sub.push({"type": "resync", "data": "{}"})
+
+    @property
+    def connections(self) -> int:
+        return sum(len(s) for s in self._subs.values())
+
+
+broker = EventBroker()
+
+
+class LocalBackend:
+    """Entrega direto no broker deste processo, depois do COMMIT."""
+
+    def publish(self, tx, user_id, event_type: str, data):
+        tx.on_commit(lambda: broker.publish_now(user_id, event_type, data))
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class PostgresBackend:
+    """
+    NOTIFY/LISTEN do Postgres. O NOTIFY é transacional (só chega aos ouvintes
+    depois do COMMIT), e os eventos de uma transação saem num único comando.
+
+    Payload: "<user_id>|<tipo>|<json>" (o json vai direto para o SSE).
+    """
+
+    def __init__(self, channel: str = EVENTS_CHANNEL):
+        self.channel = channel
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, tx, user_id, event_type: str, data):
+        pending: Optional[List[str]] = getattr(tx, "_pending_events", None)
+        if pending is None:
+            pending = tx._pending_events = []
+            tx.before_commit(self._notify)
+
+        payload = f"{user_id}|{event_type}|{dumps(data)}"
+        if len(payload.encode()) > _NOTIFY_MAX_BYTES:
+            payload = f"{user_id}|resync|{{}}"
+        pending.append(payload)
+
+    async def _notify(self, tx):
+        await tx.execute(
+            "SELECT pg_notify(%s, p) FROM unnest(%s::text[]) AS p",
+            (self.channel, tx._pending_events),
+        )
+
+    @staticmethod
+    def _dispatch(payload: str):
+        try:
+            user_id, event_type, data_json = payload.split("|", 2)
+        except ValueError:
+            logger.warning("Evento inválido no canal: %r", payload[:200])
+            return
+        broker.deliver(user_id, event_type, data_json)
+
+    async def _listen_loop(self):
+        delay = 1.0
+        reconnected = False
+        while True:
+            try:
+                conn = await db.connect_listener()
+                async with conn:
+                    await conn.execute(f'LISTEN "{self.channel}"')
+                    if reconnected:
+                        broker.resync_all()
+                    reconnected = True
+                    delay = 1.0
+                    async for notify in conn.notifies():
+                        self._dispatch(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN %s caiu; reconectando em %.0fs", self.channel, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+def _make_backend():
+    if EVENTS_BACKEND == "local":
+        return LocalBackend()
+    if EVENTS_BACKEND != "postgres":
+        raise RuntimeError(f"EVENTS_BACKEND inválido: {EVENTS_BACKEND!r} (use 'postgres' ou 'local')")
+    if db.AsyncConnection is None:
+        logger.warning("psycopg 3 não instalado: eventos em tempo real só dentro deste processo")
+        return LocalBackend()
+    return PostgresBackend()
+
+
+event_bus = _make_backend()
+
+
+def publish(tx, user_id, event_type: str, data):
+    """Publica o evento quando (e se) a transação `tx` fizer COMMIT."""
+    if not user_id:
+        return
+    event_bus.publish(tx, user_id, event_type, data)
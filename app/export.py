@@ -0,0 +1,103 @@
+"""
+Exportação em streaming (CSV ou NDJSON) dos itens de campanha e das mensagens.
+
+As linhas saem do banco em lotes por um cursor no servidor (tx.stream) e vão
+direto para a resposta: a memória não cresce com o tamanho da exportação.
+
+Cada exportação segura uma conexão do pool (e a transação) até o fim do
+download, então só EXPORT_MAX_CONCURRENT rodam ao mesmo tempo; acima disso a
+API responde 503 com Retry-After em vez de esgotar o pool.
+"""
+import csv
+import io
+import os
+from datetime import datetime
+from enum import Enum
+from typing import Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from .db import DB_POOL_MAX, transaction
+from .events import dumps
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+# Exportações simultâneas no processo (padrão: 1/4 do pool)
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", str(max(1, DB_POOL_MAX // 4))))
+EXPORT_RETRY_AFTER = int(os.getenv("EXPORT_RETRY_AFTER", "30"))
+
+_active_exports = 0
+
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+
+_MEDIA_TYPES = {
+    ExportFormat.csv: "text/csv; charset=utf-8",
+    ExportFormat.ndjson: "application/x-ndjson",
+}
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv_lines(rows, columns: Sequence[str], header: bool) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(row[c]) for c in columns])
+    return buf.getvalue()
+
+
+async def _generate(sql: str, params, columns: Sequence[str], fmt: ExportFormat):
+    if fmt == ExportFormat.csv:
+        # BOM: Excel abre o CSV em UTF-8 com acentos certos
+        yield "\ufeff" + _csv_lines([], columns, header=True)
+
+    async with transaction() as tx:
+        async for rows in tx.stream(sql, params, EXPORT_BATCH_SIZE):
+            if fmt == ExportFormat.csv:
+                yield _csv_lines(rows, columns, header=False)
+            else:
+                yield "".join(dumps({c: row[c] for c in columns}) + "\n" for row in rows)
+
+
+class _ExportResponse(StreamingResponse):
+    # libera a vaga quando a resposta termina, mesmo se o cliente desconectar
+    # antes do primeiro byte (aí o gerador nem chega a rodar)
+    async def __call__(self, scope, receive, send):
+        global _active_exports
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _active_exports -= 1
+
+
+def export_response(sql: str, params, columns: Sequence[str], fmt: ExportFormat, filename: str):
+    """
+    StreamingResponse com o resultado de `sql` (as colunas em `columns`, nessa ordem).
+    HTTPException 503 se já houver EXPORT_MAX_CONCURRENT exportações em andamento.
+    """
+    global _active_exports
+    if _active_exports >= EXPORT_MAX_CONCURRENT:
+        raise HTTPException(
+            status_code=503,
+            detail="Muitas exportações em andamento, tente de novo em instantes",
+            headers={"Retry-After": str(EXPORT_RETRY_AFTER)},
+        )
+    _active_exports += 1
+    return _ExportResponse(
+        _generate(sql, params, columns, fmt),
+        media_type=_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt.value}"'},
+    )
@@ -0,0 +1,286 @@
+"""
+Fila de ingestão dos webhooks da Meta.
+
+O endpoint só valida e enfileira o payload (responde 200 na hora); consumidores
+em background juntam vários payloads e gravam em lote (app/webhook.py).
+
+Durabilidade: se a fila em memória encher, se a gravação falhar ou no shutdown,
+os payloads vão para a tabela webhook_spill, que os consumidores também drenam.
+Se nem o spill puder ser gravado (banco fora), o consumidor segura o lote em
+memória e tenta de novo com backoff.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from . import metrics
+from .db import transaction
+from .webhook import cached_owners, ingest_payloads_tx, resolve_owners
+
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "10000"))
+WEBHOOK_CONSUMERS = int(os.getenv("WEBHOOK_CONSUMERS", "2"))
+WEBHOOK_BATCH_MAX = int(os.getenv("WEBHOOK_BATCH_MAX", "100"))          # payloads por transação
+WEBHOOK_BATCH_WAIT = float(os.getenv("WEBHOOK_BATCH_WAIT", "0.05"))     # espera para juntar um lote (s)
+WEBHOOK_SPILL_POLL = float(os.getenv("WEBHOOK_SPILL_POLL", "5"))        # de quanto em quanto tempo olha o spill (s)
+WEBHOOK_SPILL_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_SPILL_MAX_ATTEMPTS", "5"))  # depois disso fica no spill p/ análise
+WEBHOOK_RETRY_BACKOFF = float(os.getenv("WEBHOOK_RETRY_BACKOFF", "1"))          # banco fora: 1ª espera (s), dobra a cada falha
+WEBHOOK_RETRY_BACKOFF_MAX = float(os.getenv("WEBHOOK_RETRY_BACKOFF_MAX", "30"))
+
+logger = logging.getLogger(__name__)
+
+# (recebido_em epoch, payload)
+Item = Tuple[float, dict]
+
+_queue: Optional[asyncio.Queue] = None
+_consumers: List[asyncio.Task] = []
+_stop: Optional[asyncio.Event] = None
+
+_stats = {
+    "received": 0,
+    "spilled": 0,
+    "batches": 0,
+    "payloads_ingested": 0,
+    "messages_ingested": 0,
+    "failures": 0,
+    "last_lag_seconds": 0.0,
+    "max_lag_seconds": 0.0,
+}
+
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_MAX)
+    return _queue
+
+
+def stats() -> dict:
+    """Profundidade da fila, atraso de ingestão e contadores (para monitoramento)."""
+    queue = _get_queue()
+    oldest = None
+    if queue.qsize():
+        oldest = time.time() - queue._queue[0][0]  # noqa: SLF001 (só leitura)
+
+    return {
+        **_stats,
+        "queue_depth": queue.qsize(),
+        "queue_max": WEBHOOK_QUEUE_MAX,
+        "oldest_queued_seconds": oldest,
+        "consumers": len(_consumers),
+    }
+
+
+async def enqueue(payload: dict):
+    """Coloca o payload na fila. Se estiver cheia, grava direto no spill."""
+    _stats["received"] += 1
+    item = (time.time(), payload)
+    try:
+        _get_queue().put_nowait(item)
+    except asyncio.QueueFull:
+        await _spill([item])
+
+
+async def _spill(items: List[Item]):
+    if not items:
+        return
+    async with transaction() as tx:
+        await tx.execute("""
+            INSERT INTO webhook_spill (payload, received_at)
+            SELECT t.payload::jsonb, TO_TIMESTAMP(t.received_at)
+            FROM unnest(%s::text[], %s::float8[]) AS t(payload, received_at)
+        """, ([json.dumps(p) for _, p in items], [r for r, _ in items]))
+    _stats["spilled"] += len(items)
+
+
+async def _spill_or_log(items: List[Item]):
+    # último recurso (shutdown/cancelamento): não há para onde devolver os itens
+    try:
+        await _spill(items)
+    except Exception:
+        logger.exception("Não foi possível salvar %d payloads de webhook no spill", len(items))
+
+
+def _record(items: List[Item], n_messages: int):
+    lag = time.time() - min(r for r, _ in items)
+    _stats["batches"] += 1
+    _stats["payloads_ingested"] += len(items)
+    _stats["messages_ingested"] += n_messages
+    _stats["last_lag_seconds"] = lag
+    _stats["max_lag_seconds"] = max(_stats["max_lag_seconds"], lag)
+    metrics.WEBHOOK_PAYLOADS.inc(len(items))
+    metrics.WEBHOOK_INGEST_LAG_SECONDS.observe(lag)
+
+
+async def _ingest_batch(items: List[Item]):
+    """Grava o lote ou, se falhar, manda para o spill. Só levanta se o spill também falhar."""
+    payloads = [p for _, p in items]
+    try:
+        owners = await resolve_owners(payloads)  # antes da transação: pode recarregar o roteamento
+        async with transaction() as tx:
+            n = await ingest_payloads_tx(tx, payloads, owners)
+    except asyncio.CancelledError:
+        # cancelado no meio da gravação (shutdown): o lote já saiu da fila, não pode sumir
+        await _spill_or_log(items)
+        raise
+    except Exception:
+        _stats["failures"] += 1
+        logger.exception("Falha ao gravar %d payloads de webhook; indo para o spill", len(items))
+        await _spill(items)
+        return
+    _record(items, n)
+
+
+_CLAIM_SPILL = """
+    DELETE FROM webhook_spill
+    WHERE id IN (
+        SELECT id FROM webhook_spill
+        WHERE attempts < %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, payload, EXTRACT(EPOCH FROM received_at)::float8 AS received_at
+"""
+
+
+async def _drain_spill() -> int:
+    """
+    Grava um lote do spill. Apaga e ingere na mesma transação (nada se perde).
+
+    Os payloads só são conhecidos com a transação aberta, então os donos vêm do
+    roteamento já carregado (cached_owners), sem reload no meio da transação.
+    """
+    try:
+        async with transaction() as tx:
+            rows = await tx.fetchall(
+                _CLAIM_SPILL,
+                (WEBHOOK_SPILL_MAX_ATTEMPTS, WEBHOOK_BATCH_MAX),
+            )
+            if not rows:
+                return 0
+
+            items = [(row["received_at"], row["payload"]) for row in rows]
+            payloads = [p for _, p in items]
+            n = await ingest_payloads_tx(tx, payloads, cached_owners(payloads))
+    except Exception:
+        # o lote voltou para o spill (rollback); tenta um por um para isolar o payload ruim
+        logger.exception("Falha ao gravar lote do webhook_spill; tentando item a item")
+        return await _drain_spill_one_by_one(WEBHOOK_BATCH_MAX)
+
+    _record(items, n)
+    return len(items)
+
+
+async def _drain_spill_one_by_one(limit: int) -> int:
+    done = 0
+    for _ in range(limit):
+        row = None
+        try:
+            async with transaction() as tx:
+                rows = await tx.fetchall(
+                    _CLAIM_SPILL,
+                    (WEBHOOK_SPILL_MAX_ATTEMPTS, 1),
+                )
+                if not rows:
+                    break
+                row = rows[0]
+                n = await ingest_payloads_tx(tx, [row["payload"]], cached_owners([row["payload"]]))
+        except Exception as e:
+            if row is None:
+                raise
+            async with transaction() as tx:
+                await tx.execute("""
+                    UPDATE webhook_spill
+                    SET attempts = attempts + 1, last_error = %s
+                    WHERE id = %s
+                """, (str(e), row["id"]))
+            continue
+
+        _record([(row["received_at"], row["payload"])], n)
+        done += 1
+    return done
+
+
+async def _consumer(stop: asyncio.Event):
+    queue = _get_queue()
+    last_spill_check = 0.0
+    held: Optional[List[Item]] = None  # lote que não foi gravado nem no spill (banco fora)
+    backoff = WEBHOOK_RETRY_BACKOFF
+
+    while not stop.is_set() or not queue.empty() or held:
+        # de tempos em tempos (ou com a fila vazia) drena o que ficou no spill
+        if time.monotonic() - last_spill_check > WEBHOOK_SPILL_POLL:
+            last_spill_check = time.monotonic()
+            try:
+                while not stop.is_set() and await _drain_spill():
+                    pass
+            except Exception:
+                logger.exception("Falha ao drenar webhook_spill")
+
+        if held:
+            batch, held = held, None
+        else:
+            try:
+                first = await asyncio.wait_for(queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                continue
+
+            # micro-batch: junta o que chegar em WEBHOOK_BATCH_WAIT
+            batch = [first]
+            deadline = time.monotonic() + WEBHOOK_BATCH_WAIT
+            while len(batch) < WEBHOOK_BATCH_MAX:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+
+        try:
+            await _ingest_batch(batch)
+        except Exception:
+            # nem o banco nem o spill: segura o lote e tenta de novo mais tarde
+            logger.exception(
+                "Banco indisponível: %d payloads de webhook aguardam nova tentativa em %.0fs",
+                len(batch), backoff,
+            )
+            held = batch
+            try:
+                await asyncio.sleep(backoff)
+            except asyncio.CancelledError:
+                await _spill_or_log(held)
+                raise
+            backoff = min(backoff * 2, WEBHOOK_RETRY_BACKOFF_MAX)
+        else:
+            backoff = WEBHOOK_RETRY_BACKOFF
+
+
+def start_consumers(n: int = WEBHOOK_CONSUMERS):
+    global _stop, _queue
+    _stop = asyncio.Event()
+    _queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_MAX)
+    for _ in range(max(1, n)):
+        _consumers.append(asyncio.create_task(_consumer(_stop)))
+
+
+async def stop_consumers(timeout: float = 10.0):
+    """Para os consumidores; o que não der tempo de gravar vai para o spill."""
+    if _stop is not None:
+        _stop.set()
+    if _consumers:
+        _, pending = await asyncio.wait(_consumers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        # espera os cancelados salvarem no spill o lote que estavam gravando
+        await asyncio.gather(*pending, return_exceptions=True)
+        _consumers.clear()
+
+    queue = _get_queue()
+    leftovers = []
+    while not queue.empty():
+        leftovers.append(queue.get_nowait())
+    await _spill_or_log(leftovers)
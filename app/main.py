@@ -1,26 +1,77 @@
-from fastapi import FastAPI, Request, BackgroundTasks, Query, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, Response, Query, Depends, HTTPException, File, Form, UploadFile
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 import asyncio
+import hashlib
+import hmac
+import json
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Optional
 import os
 
-from psycopg2.extras import RealDictCursor
-
-from .db import get_conn
-from .meta_client import send_whatsapp_text, send_whatsapp_template
-from .models import SendTextRequest, CampaignCreate
+from .db import transaction, open_db, close_db
+from .campaign_results import flush_all_results
+from .meta_client import MetaSendError, send_whatsapp_text, start_meta_client, close_meta_client
+from .dispatcher import send_with_retry
+from .schema import ensure_schema
+from . import ingest_queue
+from .routing import routing_table
+from .events import broker, event_bus, publish
+from .worker import run_worker
+from .models import SendTextRequest, CampaignCreate, CampaignItemStatus, DiagnosticsUpdate
+from .phone_numbers import dedupe_numbers
+from .pagination import page_limit, decode_cursor, set_cursor_headers
+from . import search
+from .export import ExportFormat, export_response
+from .campaign_upload import CAMPAIGN_UPLOAD_MAX_ERRORS, import_contacts
+from .statuses import apply_status_backlog, lock_status_keys
+from . import metrics, profiling
 from .politica import router as politica_router
 from .termos import router as termos_router
 
 from .auth.auth_router import router as auth_router
-from .auth.dependencies import get_current_user
+from .auth.dependencies import get_current_user, get_admin_user
+
+
+# Worker de campanhas dentro do processo web (bom para 1 instância).
+# Em produção com vários processos: CAMPAIGN_WORKER_EMBEDDED=false e `python -m app.worker`.
+CAMPAIGN_WORKER_EMBEDDED = os.getenv("CAMPAIGN_WORKER_EMBEDDED", "true").strip().lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_db()
+    await ensure_schema()
+    await start_meta_client()
+    await routing_table.start()
+    await event_bus.start()
+
+    ingest_queue.start_consumers()
+
+    worker_stop = asyncio.Event()
+    worker_task = None
+    if CAMPAIGN_WORKER_EMBEDDED:
+        worker_task = asyncio.create_task(run_worker(worker_stop))
+
+    yield
 
+    worker_stop.set()
+    if worker_task:
+        await worker_task
+    await ingest_queue.stop_consumers()
+    await event_bus.stop()
+    await routing_table.stop()
+    await flush_all_results()
+    await close_meta_client()
+    await close_db()
 
-app = FastAPI(title="Painel WhatsApp Oficial (API Oficial Meta)")
+
+app = FastAPI(title="Painel WhatsApp Oficial (API Oficial Meta)", lifespan=lifespan)
 
 app.include_router(auth_router)
 app.include_router(politica_router)
@@ -39,7 +90,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# latência por rota (ver /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+# profiling por amostragem, desligado por padrão (ver /api/admin/diagnostics)
+app.add_middleware(profiling.ProfilingMiddleware)
+
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "SEU_VERIFY_TOKEN_AQUI")
+# Se configurado, valida o header X-Hub-Signature-256 dos webhooks
+META_APP_SECRET = os.getenv("META_APP_SECRET")
 
 
 # =======================
@@ -55,63 +113,206 @@ async def index(request: Request):
 # HELPERS
 # =======================
 
-def _dict_cursor(conn):
-    return conn.cursor(cursor_factory=RealDictCursor)
-
 def _get_user_id(user):
     # get_current_user retorna dict
     return str(user["id"])
 
+async def _check_sender(phone_number_id: str, user_id: str):
+    # phone_number_id cadastrado para outro usuário não pode ser usado para enviar
+    owner = await routing_table.owner_of(phone_number_id)
+    if owner and owner != user_id:
+        raise HTTPException(status_code=403, detail="phone_number_id não pertence ao usuário")
+
 
 # =======================
 # CONVERSAS E MENSAGENS (CHAT) - PROTEGIDO
 # =======================
 
 @app.get("/api/conversations")
-async def list_conversations(user=Depends(get_current_user)):
+async def list_conversations(
+    request: Request,
+    response: Response,
+    after: Optional[str] = Query(None, description="Cursor: conversas depois desta na lista"),
+    updated_since: Optional[datetime] = Query(None, description="Só conversas alteradas depois deste instante"),
+    limit: Optional[int] = Query(None, ge=1),
+    user=Depends(get_current_user),
+):
     """
-    Lista somente conversas do usuário logado.
+    Lista somente conversas do usuário logado (mais recentes primeiro).
+
+    Paginação por cursor em (last_message_at, id) via `after` (X-Cursor-After),
+    `updated_since` traz só as que mudaram (X-Updated-At = valor para a próxima
+    chamada). Responde 304 quando o ETag (última alteração + quantidade) bate
+    com If-None-Match.
     """
-    conn = get_conn()
-    cur = _dict_cursor(conn)
-    cur.execute("""
-        SELECT id, wa_id, name, last_message_text, last_message_at, unread_count, created_at
-        FROM conversations
-        WHERE user_id = %s
-        ORDER BY last_message_at DESC NULLS LAST, created_at DESC
-    """, (_get_user_id(user),))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    user_id = _get_user_id(user)
+    limit = page_limit(limit)
+
+    where, params = "", []
+    if updated_since is not None:
+        where += " AND updated_at > %s"
+        params.append(updated_since)
+    if after is not None:
+        ts, row_id = decode_cursor(after)
+        if ts is None:
+            where += " AND last_message_at IS NULL AND id < %s::uuid"
+            params.append(row_id)
+        else:
+            where += """
+                AND (last_message_at < %s
+                     OR (last_message_at = %s AND id < %s::uuid)
+                     OR last_message_at IS NULL)
+            """
+            params += [ts, ts, row_id]
+
+    async with transaction() as tx:
+        # índice conversations(user_id, updated_at)
+        version = await tx.fetchone("""
+            SELECT MAX(updated_at) AS updated_at, COUNT(*) AS n
+            FROM conversations
+            WHERE user_id = %s
+        """, (user_id,))
+
+        # mesma lista (mesmos filtros) e nada mudou: não serializa nada
+        etag = 'W/"%s"' % hashlib.sha1(
+            f"{version['updated_at']}|{version['n']}|{after}|{updated_since}|{limit}".encode()
+        ).hexdigest()
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if version["updated_at"] is not None:
+            headers["X-Updated-At"] = version["updated_at"].isoformat()
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        # índice conversations(user_id, last_message_at DESC NULLS LAST, id DESC)
+        rows = await tx.fetchall(f"""
+            SELECT id, wa_id, name, last_message_text, last_message_at, unread_count, created_at, updated_at
+            FROM conversations
+            WHERE user_id = %s {where}
+            ORDER BY last_message_at DESC NULLS LAST, id DESC
+            LIMIT %s
+        """, (user_id, *params, limit + 1))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    response.headers.update(headers)
+    set_cursor_headers(response, rows, has_more, "last_message_at")
     return rows
 
 
+@app.get("/api/conversations/search")
+async def search_conversations(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0, le=10000),
+    user=Depends(get_current_user),
+):
+    """
+    Busca nas conversas do usuário por nome, wa_id e texto das mensagens,
+    mais relevantes primeiro. Paginação por offset (X-Has-More).
+    """
+    term = q.strip()
+    if not term:
+        raise HTTPException(status_code=400, detail="Informe o termo de busca")
+    limit = page_limit(limit)
+
+    async with transaction() as tx:
+        rows = await search.search_conversations(tx, _get_user_id(user), term, limit, offset)
+
+    response.headers["X-Has-More"] = "true" if len(rows) > limit else "false"
+    return rows[:limit]
+
+
 @app.get("/api/conversations/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str, user=Depends(get_current_user)):
+async def get_conversation_messages(
+    conversation_id: str,
+    response: Response,
+    before: Optional[str] = Query(None, description="Cursor: mensagens anteriores a esta"),
+    after: Optional[str] = Query(None, description="Cursor: mensagens posteriores a esta"),
+    since: Optional[datetime] = Query(None, description="Só mensagens com timestamp depois deste"),
+    limit: Optional[int] = Query(None, ge=1),
+    user=Depends(get_current_user),
+):
     """
     Lista mensagens de uma conversa específica, mas só se a conversa for do usuário.
+
+    Sempre em ordem cronológica. Sem parâmetros: as `limit` mais recentes.
+    `before` pagina para trás, `after`/`since` trazem só o que chegou depois
+    (cursores em X-Cursor-Before / X-Cursor-After, ver app/pagination.py).
     """
-    conn = get_conn()
-    cur = _dict_cursor(conn)
+    if sum(p is not None for p in (before, after, since)) > 1:
+        raise HTTPException(status_code=400, detail="Use só um de before, after ou since")
+    limit = page_limit(limit)
+
+    cols = "id, conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp, created_at"
+    if after is not None:
+        ts, row_id = decode_cursor(after)
+        where, params, newest_first = "AND (timestamp, id) > (%s, %s::uuid)", [ts, row_id], False
+    elif since is not None:
+        where, params, newest_first = "AND timestamp > %s", [since], False
+    elif before is not None:
+        ts, row_id = decode_cursor(before)
+        where, params, newest_first = "AND (timestamp, id) < (%s, %s::uuid)", [ts, row_id], True
+    else:
+        where, params, newest_first = "", [], True
+
+    order = "DESC" if newest_first else "ASC"
+
+    async with transaction() as tx:
+        # garante dono
+        owner = await tx.fetchone(
+            "SELECT id FROM conversations WHERE id=%s AND user_id=%s",
+            (conversation_id, _get_user_id(user)),
+        )
+        if not owner:
+            raise HTTPException(status_code=404, detail="Conversa não encontrada")
+
+        # índice messages(conversation_id, timestamp, id): lê só a página
+        rows = await tx.fetchall(f"""
+            SELECT {cols}
+            FROM messages
+            WHERE conversation_id = %s {where}
+            ORDER BY timestamp {order}, id {order}
+            LIMIT %s
+        """, (conversation_id, *params, limit + 1))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newest_first:
+        rows.reverse()
+
+    set_cursor_headers(response, rows, has_more, "timestamp")
+    return rows
+
 
-    # garante dono
-    cur.execute("SELECT id FROM conversations WHERE id=%s AND user_id=%s", (conversation_id, _get_user_id(user)))
-    owner = cur.fetchone()
+@app.get("/api/conversations/{conversation_id}/messages/export")
+async def export_conversation_messages(
+    conversation_id: str,
+    format: ExportFormat = Query(ExportFormat.csv),
+    user=Depends(get_current_user),
+):
+    """Histórico completo da conversa em CSV/NDJSON (streaming, sem limite de linhas)."""
+    async with transaction() as tx:
+        owner = await tx.fetchone(
+            "SELECT id FROM conversations WHERE id=%s AND user_id=%s",
+            (conversation_id, _get_user_id(user)),
+        )
     if not owner:
-        cur.close()
-        conn.close()
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
 
-    cur.execute("""
-        SELECT id, conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp, created_at
+    return export_response(
+        """
+        SELECT id, direction, type, text, wa_id, status, meta_message_id, timestamp, created_at
         FROM messages
         WHERE conversation_id = %s
-        ORDER BY timestamp ASC
-    """, (conversation_id,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
+        ORDER BY timestamp, id
+        """,
+        (conversation_id,),
+        ("id", "direction", "type", "text", "wa_id", "status", "meta_message_id", "timestamp", "created_at"),
+        format,
+        f"conversa-{conversation_id}",
+    )
 
 
 @app.post("/api/messages/text")
@@ -121,51 +322,112 @@ async def send_text_message(payload: SendTextRequest, user=Depends(get_current_u
     Só permite enviar em conversas do próprio usuário (pelo wa_id).
     """
     user_id = _get_user_id(user)
-
-    conn = get_conn()
-    cur = _dict_cursor(conn)
+    await _check_sender(payload.phone_number_id, user_id)
 
     # conversa precisa pertencer ao usuário
-    cur.execute("SELECT id FROM conversations WHERE wa_id=%s AND user_id=%s", (payload.to, user_id))
-    row = cur.fetchone()
+    async with transaction() as tx:
+        row = await tx.fetchone(
+            "SELECT id FROM conversations WHERE wa_id=%s AND user_id=%s",
+            (payload.to, user_id),
+        )
+
     if not row:
-        cur.close()
-        conn.close()
         raise HTTPException(status_code=403, detail="Conversa não pertence ao usuário")
 
     conversation_id = row["id"]
 
-    # 1) Envia para a API da Meta
-    meta_id = await send_whatsapp_text(
-        to=payload.to,
-        text=payload.message,
-        phone_number_id=payload.phone_number_id
-    )
-
-    # 2) Insere a mensagem enviada
-    cur.execute("""
-        INSERT INTO messages (
-            conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp
+    # 1) Envia para a API da Meta (sem segurar conexão do pool durante a chamada HTTP).
+    #    Erros temporários são repetidos; timeout não (a mensagem pode ter saído).
+    try:
+        meta_id = await send_with_retry(
+            lambda: send_whatsapp_text(
+                to=payload.to,
+                text=payload.message,
+                phone_number_id=payload.phone_number_id
+            ),
+            payload.phone_number_id,
+            block=False,
         )
-        VALUES (%s, 'outgoing', 'text', %s, %s, 'sent', %s, NOW())
-    """, (conversation_id, payload.message, payload.to, meta_id))
-
-    # 3) Atualiza dados da conversa
-    cur.execute("""
-        UPDATE conversations
-        SET last_message_text = %s,
-            last_message_at = NOW(),
-            unread_count = 0
-        WHERE id = %s
-    """, (payload.message, conversation_id))
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    except MetaSendError as e:
+        status_code = 502 if e.kind == MetaSendError.PERMANENT else 503
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+    async with transaction() as tx:
+        # um webhook de status deste id, chegando agora, espera este commit
+        await lock_status_keys(tx, [meta_id])
+
+        # 2) Insere a mensagem enviada
+        msg = await tx.fetchone("""
+            INSERT INTO messages (
+                conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp
+            )
+            VALUES (%s, 'outgoing', 'text', %s, %s, 'sent', %s, NOW())
+            RETURNING id, conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp, created_at
+        """, (conversation_id, payload.message, payload.to, meta_id))
+
+        # 3) Atualiza dados da conversa
+        conv = await tx.fetchone("""
+            UPDATE conversations
+            SET last_message_text = %s,
+                last_message_at = NOW(),
+                unread_count = 0,
+                updated_at = clock_timestamp()
+            WHERE id = %s
+            RETURNING id, wa_id, name, last_message_text, last_message_at, unread_count, created_at
+        """, (payload.message, conversation_id))
+
+        # webhook de status pode ter chegado antes deste COMMIT
+        await apply_status_backlog(tx, [meta_id])
+
+        # outras abas/dispositivos do usuário
+        publish(tx, user_id, "message.new", msg)
+        publish(tx, user_id, "conversation.updated", conv)
 
     return {"status": "sent", "conversation_id": conversation_id, "meta_message_id": meta_id}
 
 
+# =======================
+# TEMPO REAL (SSE) - PROTEGIDO
+# =======================
+
+SSE_PING_SECONDS = float(os.getenv("SSE_PING_SECONDS", "15"))
+
+
+@app.get("/api/events")
+async def events_stream(request: Request, user=Depends(get_current_user)):
+    """
+    Server-Sent Events do usuário logado: message.new, conversation.updated,
+    campaign.progress. Substitui o polling do painel.
+    """
+    user_id = _get_user_id(user)
+
+    async def stream():
+        with broker.subscribe(user_id) as sub:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                if sub.overflowed:
+                    # perdeu eventos: cliente recarrega tudo
+                    sub.overflowed = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    yield "event: resync\ndata: {}\n\n"
+                    continue
+
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=SSE_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+
+                yield f"event: {event['type']}\ndata: {event['data']}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # =======================
 # WEBHOOK META - NÃO PROTEGIDO (OBRIGATÓRIO)
 # =======================
@@ -185,115 +447,92 @@ async def verify_webhook(
 async def receive_webhook(request: Request):
     """
     Recebe mensagens e status enviados pela Meta.
-    Salva mensagens RECEBIDAS no banco.
-    Atribui a conversa ao usuário correto via metadata.phone_number_id.
+    Só valida e enfileira: a gravação é feita em lote pelos consumidores
+    de app/ingest_queue.py, então a Meta recebe o 200 na hora.
     """
-    body = await request.json()
-    entries = body.get("entry", [])
-
-    conn = get_conn()
-    cur = _dict_cursor(conn)
-
-    for entry in entries:
-        changes = entry.get("changes", [])
-        for change in changes:
-            value = change.get("value", {})
-
-            metadata = value.get("metadata", {}) or {}
-            phone_number_id = metadata.get("phone_number_id")
-
-            # Descobrir o usuário dono desse phone_number_id
-            user_id = None
-            if phone_number_id:
-                cur.execute("""
-                    SELECT id FROM users
-                    WHERE phone_number_id = %s AND is_active = true
-                    LIMIT 1
-                """, (str(phone_number_id),))
-                u = cur.fetchone()
-                if u:
-                    user_id = str(u["id"])
-
-            # Se não achar usuário, ainda salva (mas sem user_id) OU você pode ignorar.
-            # Aqui vamos salvar user_id NULL se não achar.
-            messages = value.get("messages", [])
-            for msg in messages:
-                from_wa = msg.get("from")  # telefone 5511...
-                text = msg.get("text", {}).get("body", "")
-                ts_str = msg.get("timestamp", "0")
+    raw = await request.body()
 
-                try:
-                    ts = int(ts_str)
-                except ValueError:
-                    ts = int(datetime.utcnow().timestamp())
-
-                # 1) Garante a conversa (sempre do mesmo user_id)
-                if user_id:
-                    cur.execute("""
-                        SELECT id FROM conversations
-                        WHERE wa_id = %s AND user_id = %s
-                    """, (from_wa, user_id))
-                else:
-                    cur.execute("""
-                        SELECT id FROM conversations
-                        WHERE wa_id = %s AND user_id IS NULL
-                    """, (from_wa,))
-                row = cur.fetchone()
-
-                if row:
-                    conversation_id = row["id"]
-                else:
-                    cur.execute("""
-                        INSERT INTO conversations (user_id, wa_id, name, last_message_text, last_message_at, unread_count)
-                        VALUES (%s, %s, %s, %s, TO_TIMESTAMP(%s), 1)
-                        RETURNING id
-                    """, (user_id, from_wa, from_wa, text, ts))
-                    conversation_id = cur.fetchone()["id"]
-
-                # 2) Insere mensagem recebida
-                cur.execute("""
-                    INSERT INTO messages (
-                        conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp
-                    )
-                    VALUES (%s, 'incoming', 'text', %s, %s, 'received', NULL, TO_TIMESTAMP(%s))
-                """, (conversation_id, text, from_wa, ts))
-
-                # 3) Atualiza conversa
-                cur.execute("""
-                    UPDATE conversations
-                    SET last_message_text = %s,
-                        last_message_at = TO_TIMESTAMP(%s),
-                        unread_count = unread_count + 1
-                    WHERE id = %s
-                """, (text, ts, conversation_id))
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    if META_APP_SECRET:
+        expected = "sha256=" + hmac.new(META_APP_SECRET.encode(), raw, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, request.headers.get("X-Hub-Signature-256", "")):
+            raise HTTPException(status_code=403, detail="Assinatura inválida")
+
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+
+    if not isinstance(body, dict) or not isinstance(body.get("entry", []), list):
+        raise HTTPException(status_code=400, detail="Payload inválido")
+
+    await ingest_queue.enqueue(body)
     return {"status": "ok"}
 
 
-# =======================
-# CAMPANHAS (DISPARO EM MASSA) - PROTEGIDO
-# =======================
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(
+    creds: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+):
+    """Métricas no formato do Prometheus (app/metrics.py). Exige METRICS_TOKEN ou admin."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not metrics.METRICS_PUBLIC:
+        if creds is None:
+            raise HTTPException(status_code=401, detail="Não autenticado")
+        token_ok = bool(metrics.METRICS_TOKEN) and hmac.compare_digest(metrics.METRICS_TOKEN, creds.credentials)
+        if not token_ok:
+            # sem o token do Prometheus: só um admin logado
+            await get_admin_user(await get_current_user(creds))
 
-@app.post("/api/campaigns")
-async def create_campaign(payload: CampaignCreate, background_tasks: BackgroundTasks, user=Depends(get_current_user)):
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/api/admin/diagnostics")
+async def get_diagnostics(user=Depends(get_admin_user)):
+    """Configuração atual do profiling e do log de queries lentas (deste processo)."""
+    return profiling.describe()
+
+
+@app.put("/api/admin/diagnostics")
+async def update_diagnostics(payload: DiagnosticsUpdate, user=Depends(get_admin_user)):
     """
-    Cria campanha do usuário logado e dispara em background.
+    Liga/desliga o profiling e o log de queries lentas sem restart.
+    Vale só para o processo que atender a chamada.
     """
-    user_id = _get_user_id(user)
+    changes = payload.model_dump(exclude_none=True)
+    rate = changes.get("profile_sample_rate")
+    if rate is not None and not 0 <= rate <= 1:
+        return {"error": "profile_sample_rate deve estar entre 0 e 1"}
+    if any(changes.get(k, 0) < 0 for k in ("profile_min_ms", "slow_query_ms")):
+        return {"error": "Tempos não podem ser negativos"}
+    return profiling.update_settings(changes)
 
-    if not payload.template_name and not payload.message_text:
-        return {"error": "Informe template_name OU message_text."}
 
-    if payload.template_name and payload.message_text:
+@app.get("/api/admin/webhook-stats")
+async def webhook_stats(user=Depends(get_admin_user)):
+    """
+    Profundidade da fila de ingestão, atraso (lag) e contadores deste processo.
+    Só admin: os números são do sistema todo, não do usuário.
+    """
+    return ingest_queue.stats()
+
+
+# =======================
+# CAMPANHAS (DISPARO EM MASSA) - PROTEGIDO
+# =======================
+
+def _campaign_mode_error(template_name, message_text):
+    if not template_name and not message_text:
+        return {"error": "Informe template_name OU message_text."}
+    if template_name and message_text:
         return {"error": "Use apenas template_name OU message_text, não os dois."}
+    return None
 
-    conn = get_conn()
-    cur = _dict_cursor(conn)
 
-    cur.execute("""
+async def _insert_campaign(tx, user_id, name, phone_number_id, template_name,
+                           template_language_code, template_body_params, message_text, total):
+    row = await tx.fetchone("""
         INSERT INTO campaigns (
             user_id,
             name,
@@ -311,32 +550,107 @@ async def create_campaign(payload: CampaignCreate, background_tasks: BackgroundT
         RETURNING id
     """, (
         user_id,
-        payload.name,
-        payload.phone_number_id,
-        payload.template_name,
-        payload.template_language_code or "pt_BR",
-        payload.template_body_params,
-        payload.message_text,
-        len(payload.to_numbers),
+        name,
+        phone_number_id,
+        template_name,
+        template_language_code or "pt_BR",
+        template_body_params,
+        message_text,
+        total,
     ))
-    row = cur.fetchone()
-    campaign_id = row["id"]
+    return row["id"]
+
+
+@app.post("/api/campaigns")
+async def create_campaign(payload: CampaignCreate, user=Depends(get_current_user)):
+    """
+    Cria campanha do usuário logado. O envio é feito pelo worker (app/worker.py),
+    que pega campanhas 'pending' da fila.
+    """
+    user_id = _get_user_id(user)
+
+    error = _campaign_mode_error(payload.template_name, payload.message_text)
+    if error:
+        return error
+
+    await _check_sender(payload.phone_number_id, user_id)
+
+    # normaliza (E.164) e remove duplicados/vazios antes de ir pro banco
+    # (resposta no mesmo formato do upload CSV, com a posição no lugar da linha)
+    to_numbers, invalid = dedupe_numbers(payload.to_numbers)
+    rows = sum(1 for raw in payload.to_numbers if raw and raw.strip())
+    report = {
+        "total": len(to_numbers),
+        "rows": rows,
+        "invalid": len(invalid),
+        "duplicates": rows - len(invalid) - len(to_numbers),
+        "errors": [
+            {"index": i, "value": raw[:50], "error": "Número inválido (E.164)"}
+            for i, raw in invalid[:CAMPAIGN_UPLOAD_MAX_ERRORS]
+        ],
+    }
+    if not to_numbers:
+        return {"error": "Nenhum número válido em to_numbers.", **report}
+
+    async with transaction() as tx:
+        campaign_id = await _insert_campaign(
+            tx, user_id, payload.name, payload.phone_number_id, payload.template_name,
+            payload.template_language_code, payload.template_body_params, payload.message_text,
+            len(to_numbers),
+        )
+
+        # itens entram via COPY (um round trip, sem um INSERT por número)
+        await tx.copy_rows(
+            "campaign_items",
+            ("campaign_id", '"to"', "status"),
+            ((campaign_id, num, "pending") for num in to_numbers),
+        )
+
+    return {"status": "created", "campaign_id": campaign_id, **report}
 
-    for num in payload.to_numbers:
-        num_clean = num.strip()
-        if not num_clean:
-            continue
-        cur.execute("""
-            INSERT INTO campaign_items (campaign_id, "to", status)
-            VALUES (%s, %s, 'pending')
-        """, (campaign_id, num_clean))
 
-    conn.commit()
-    cur.close()
-    conn.close()
+@app.post("/api/campaigns/upload")
+async def create_campaign_from_csv(
+    file: UploadFile = File(..., description="CSV: número + colunas de parâmetros do template"),
+    name: str = Form(...),
+    phone_number_id: str = Form(...),
+    message_text: Optional[str] = Form(None),
+    template_name: Optional[str] = Form(None),
+    template_language_code: Optional[str] = Form("pt_BR"),
+    template_body_params: Optional[str] = Form(None, description="Um por linha; vale para quem não tiver colunas extras"),
+    user=Depends(get_current_user),
+):
+    """
+    Cria campanha a partir de um CSV de contatos (milhões de linhas), lido e
+    gravado em blocos. Ver formato em app/campaign_upload.py.
+    """
+    user_id = _get_user_id(user)
+    message_text = (message_text or "").strip() or None
+    template_name = (template_name or "").strip() or None
 
-    background_tasks.add_task(run_campaign, campaign_id)
-    return {"status": "created", "campaign_id": campaign_id}
+    error = _campaign_mode_error(template_name, message_text)
+    if error:
+        return error
+
+    await _check_sender(phone_number_id, user_id)
+
+    default_params = None
+    if template_body_params:
+        default_params = [p.strip() for p in template_body_params.splitlines() if p.strip()] or None
+
+    async with transaction() as tx:
+        campaign_id = await _insert_campaign(
+            tx, user_id, name, phone_number_id, template_name,
+            template_language_code, default_params, message_text, 0,
+        )
+        result = await import_contacts(tx, campaign_id, file.file, with_params=bool(template_name))
+        if not result["total"]:
+            # rollback: não deixa campanha vazia para trás
+            raise HTTPException(status_code=400, detail={"error": "Nenhum número válido no arquivo.", **result})
+
+        await tx.execute("UPDATE campaigns SET total = %s WHERE id = %s", (result["total"], campaign_id))
+
+    return {"status": "created", "campaign_id": campaign_id, **result}
 
 
 @app.get("/api/campaigns")
@@ -344,129 +658,136 @@ async def list_campaigns(user=Depends(get_current_user)):
     """
     Lista somente campanhas do usuário logado.
     """
-    conn = get_conn()
-    cur = _dict_cursor(conn)
-    cur.execute("""
-        SELECT id, name, phone_number_id, template_name, template_language_code,
-               message_text, total, sent, failed, status, created_at
-        FROM campaigns
-        WHERE user_id = %s
-        ORDER BY created_at DESC
-    """, (_get_user_id(user),))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    async with transaction() as tx:
+        rows = await tx.fetchall("""
+            SELECT id, name, phone_number_id, template_name, template_language_code,
+                   message_text, total, sent, failed, delivered, read, status, created_at
+            FROM campaigns
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+        """, (_get_user_id(user),))
     return rows
 
 
-@app.get("/api/campaigns/{campaign_id}/items")
-async def list_campaign_items(campaign_id: str, user=Depends(get_current_user)):
-    """
-    Lista itens da campanha se ela for do usuário.
-    """
-    conn = get_conn()
-    cur = _dict_cursor(conn)
+CAMPAIGN_SUMMARY_TOP_ERRORS = int(os.getenv("CAMPAIGN_SUMMARY_TOP_ERRORS", "20"))
 
-    cur.execute("SELECT id FROM campaigns WHERE id=%s AND user_id=%s", (campaign_id, _get_user_id(user)))
-    owner = cur.fetchone()
-    if not owner:
-        cur.close()
-        conn.close()
-        raise HTTPException(status_code=404, detail="Campanha não encontrada")
 
-    cur.execute("""
-        SELECT id, campaign_id, "to", status, error_message, created_at
-        FROM campaign_items
-        WHERE campaign_id = %s
-        ORDER BY created_at ASC
-    """, (campaign_id,))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return rows
+async def _check_campaign_owner(tx, campaign_id: str, user) -> dict:
+    camp = await tx.fetchone(
+        "SELECT id, name, total, sent, failed, delivered, read, status, created_at FROM campaigns WHERE id=%s AND user_id=%s",
+        (campaign_id, _get_user_id(user)),
+    )
+    if not camp:
+        raise HTTPException(status_code=404, detail="Campanha não encontrada")
+    return camp
 
 
-async def run_campaign(campaign_id: str):
+@app.get("/api/campaigns/{campaign_id}/items")
+async def list_campaign_items(
+    campaign_id: str,
+    response: Response,
+    status: Optional[CampaignItemStatus] = Query(None),
+    after: Optional[str] = Query(None, description="Cursor: itens depois deste (X-Cursor-After)"),
+    limit: Optional[int] = Query(None, ge=1),
+    user=Depends(get_current_user),
+):
     """
-    Envia as mensagens de uma campanha em background.
+    Lista itens da campanha se ela for do usuário, paginado por cursor em
+    (created_at, id) e opcionalmente filtrado por status.
     """
-    conn = get_conn()
-    cur = _dict_cursor(conn)
+    where, params = "", []
+    if status is not None:
+        where += " AND status = %s"
+        params.append(status.value)
+    if after is not None:
+        ts, row_id = decode_cursor(after)
+        where += " AND (created_at, id) > (%s, %s::uuid)"
+        params += [ts, row_id]
+    limit = page_limit(limit)
+
+    async with transaction() as tx:
+        await _check_campaign_owner(tx, campaign_id, user)
+
+        # índices campaign_items(campaign_id, status, created_at, id) / (campaign_id, created_at, id)
+        rows = await tx.fetchall(f"""
+            SELECT id, campaign_id, "to", status, delivery_status, meta_message_id, error_message, created_at
+            FROM campaign_items
+            WHERE campaign_id = %s {where}
+            ORDER BY created_at ASC, id ASC
+            LIMIT %s
+        """, (campaign_id, *params, limit + 1))
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    set_cursor_headers(response, rows, has_more, "created_at")
+    return rows
 
-    cur.execute("SELECT * FROM campaigns WHERE id = %s", (campaign_id,))
-    camp = cur.fetchone()
-    if not camp:
-        cur.close()
-        conn.close()
-        return
 
-    cur.execute("UPDATE campaigns SET status='running' WHERE id=%s", (campaign_id,))
-    conn.commit()
+@app.get("/api/campaigns/{campaign_id}/items/export")
+async def export_campaign_items(
+    campaign_id: str,
+    format: ExportFormat = Query(ExportFormat.csv),
+    status: Optional[CampaignItemStatus] = Query(None),
+    user=Depends(get_current_user),
+):
+    """Resultado da campanha em CSV/NDJSON (streaming, sem limite de linhas)."""
+    async with transaction() as tx:
+        await _check_campaign_owner(tx, campaign_id, user)
 
-    template_name = camp.get("template_name")
-    template_language_code = camp.get("template_language_code") or "pt_BR"
-    template_body_params = camp.get("template_body_params")
-    message_text = camp.get("message_text")
-    phone_number_id = camp.get("phone_number_id")
+    where, params = "", [campaign_id]
+    if status is not None:
+        where, params = " AND status = %s", [campaign_id, status.value]
 
-    cur.execute("""
-        SELECT id, "to", status
+    return export_response(
+        f"""
+        SELECT id, "to", status, delivery_status, meta_message_id, error_message, attempts, created_at
         FROM campaign_items
-        WHERE campaign_id = %s AND status = 'pending'
-        ORDER BY created_at ASC
-    """, (campaign_id,))
-    items = cur.fetchall()
-
-    DELAY_SECONDS = 0.2
-    sent = camp.get("sent", 0)
-    failed = camp.get("failed", 0)
-
-    for item in items:
-        item_id = item["id"]
-        to_number = item["to"]
-
-        try:
-            if template_name:
-                await send_whatsapp_template(
-                    to=to_number,
-                    phone_number_id=phone_number_id,
-                    template_name=template_name,
-                    language_code=template_language_code,
-                    body_params=template_body_params,
-                )
-            else:
-                await send_whatsapp_text(
-                    to=to_number,
-                    text=message_text,
-                    phone_number_id=phone_number_id,
-                )
-
-            cur.execute("""
-                UPDATE campaign_items
-                SET status = 'sent', error_message = NULL
-                WHERE id = %s
-            """, (item_id,))
-            sent += 1
-
-        except Exception as e:
-            cur.execute("""
-                UPDATE campaign_items
-                SET status = 'failed', error_message = %s
-                WHERE id = %s
-            """, (str(e), item_id))
-            failed += 1
-
-        cur.execute("""
-            UPDATE campaigns
-            SET sent = %s, failed = %s
-            WHERE id = %s
-        """, (sent, failed, campaign_id))
-
-        conn.commit()
-        await asyncio.sleep(DELAY_SECONDS)
+        WHERE campaign_id = %s {where}
+        ORDER BY created_at, id
+        """,
+        params,
+        ("id", "to", "status", "delivery_status", "meta_message_id", "error_message", "attempts", "created_at"),
+        format,
+        f"campanha-{campaign_id}",
+    )
 
-    cur.execute("UPDATE campaigns SET status='finished' WHERE id=%s", (campaign_id,))
-    conn.commit()
 
-    cur.close()
-    conn.close()
+@app.get("/api/campaigns/{campaign_id}/summary")
+async def campaign_summary(campaign_id: str, user=Depends(get_current_user)):
+    """
+    Resumo da campanha calculado no banco: quantidade por status, por status
+    de entrega e os erros mais frequentes (sem baixar os itens).
+    """
+    async with transaction() as tx:
+        camp = await _check_campaign_owner(tx, campaign_id, user)
+
+        by_status = await tx.fetchall("""
+            SELECT status, COUNT(*) AS count
+            FROM campaign_items
+            WHERE campaign_id = %s
+            GROUP BY status
+        """, (campaign_id,))
+
+        by_delivery = await tx.fetchall("""
+            SELECT delivery_status, COUNT(*) AS count
+            FROM campaign_items
+            WHERE campaign_id = %s AND status = 'sent'
+            GROUP BY delivery_status
+        """, (campaign_id,))
+
+        errors = await tx.fetchall("""
+            SELECT error_message, COUNT(*) AS count
+            FROM campaign_items
+            WHERE campaign_id = %s AND (status = 'failed' OR delivery_status = 'failed')
+            GROUP BY error_message
+            ORDER BY count DESC, error_message
+            LIMIT %s
+        """, (campaign_id, CAMPAIGN_SUMMARY_TOP_ERRORS))
+
+    return {
+        "campaign": camp,
+        "by_status": {row["status"]: row["count"] for row in by_status},
+        # entregas dos enviados (None = Meta ainda não confirmou)
+        "by_delivery_status": {row["delivery_status"]: row["count"] for row in by_delivery},
+        "errors": errors,
+    }
@@ -1,29 +1,199 @@
 import httpx
+import json
 import os
+import time
 from dotenv import load_dotenv
-from typing import List, Optional
+from typing import List, Optional, Sequence
+
+from . import metrics
+
+try:
+    import h2  # noqa: F401  (necessário para HTTP/2 no httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import orjson  # opcional: serialização bem mais rápida dos payloads
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
 
 load_dotenv()
 
-META_BASE_URL = "https://graph.facebook.com/v21.0"
+# outro endereço só para testes de carga (ex: bench/fake_meta.py)
+META_BASE_URL = os.getenv("META_BASE_URL", "https://graph.facebook.com/v21.0")
 META_ACCESS_TOKEN = os.getenv("META_ACCESS_TOKEN")
 
+# Cliente HTTP compartilhado (keep-alive) com a Graph API
+META_TIMEOUT = float(os.getenv("META_TIMEOUT", "30"))
+META_MAX_CONNECTIONS = int(os.getenv("META_MAX_CONNECTIONS", "100"))
+META_MAX_KEEPALIVE = int(os.getenv("META_MAX_KEEPALIVE", "20"))
+META_KEEPALIVE_EXPIRY = float(os.getenv("META_KEEPALIVE_EXPIRY", "60"))
+META_HTTP2 = os.getenv("META_HTTP2", "false").strip().lower() in ("1", "true", "yes")  # requer httpx[http2]
+
+_client: Optional[httpx.AsyncClient] = None
+
+# Códigos de erro da Graph API que significam "vai mais devagar"
+RATE_LIMIT_ERROR_CODES = {4, 80007, 130429, 131056}
+# Erros temporários do lado da Meta: a mensagem não saiu, pode tentar de novo
+RETRYABLE_ERROR_CODES = {1, 2, 131000, 131016, 133004}
 
-async def send_whatsapp_text(to: str, text: str, phone_number_id: str) -> str:
+
+class MetaSendError(Exception):
     """
-    Envia mensagem de TEXTO pela API oficial da Meta.
-    Retorna o ID da mensagem gerado pela Meta.
+    Falha de envio já classificada (`kind`):
+
+    - rate_limit: a Meta pediu para ir mais devagar (retry_after, se veio)
+    - retryable: erro temporário, a mensagem não saiu; pode reenviar
+    - ambiguous: a requisição pode ter chegado (timeout de leitura, 504);
+      reenviar às cegas pode duplicar a mensagem
+    - permanent: número inválido, template reprovado, token... não adianta repetir
     """
+
+    RATE_LIMIT = "rate_limit"
+    RETRYABLE = "retryable"
+    AMBIGUOUS = "ambiguous"
+    PERMANENT = "permanent"
+
+    def __init__(self, message: str, kind: str, status_code: Optional[int] = None,
+                 code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.status_code = status_code
+        self.code = code
+        self.retry_after = retry_after
+
+
+def _classify_response(r: httpx.Response) -> MetaSendError:
+    code = None
+    message = r.text[:300]
+    try:
+        error = r.json().get("error") or {}
+        code = error.get("code")
+        details = (error.get("error_data") or {}).get("details")
+        message = details or error.get("message") or message
+    except (ValueError, AttributeError):
+        pass
+
+    retry_after = None
+    try:
+        retry_after = float(r.headers.get("Retry-After", ""))
+    except ValueError:
+        pass
+
+    if r.status_code == 429 or code in RATE_LIMIT_ERROR_CODES:
+        kind = MetaSendError.RATE_LIMIT
+    elif r.status_code == 504:
+        kind = MetaSendError.AMBIGUOUS
+    elif code in RETRYABLE_ERROR_CODES or r.status_code >= 500:
+        kind = MetaSendError.RETRYABLE
+    else:
+        kind = MetaSendError.PERMANENT
+
+    label = f"Meta {r.status_code}" + (f" (código {code})" if code is not None else "")
+    return MetaSendError(f"{label}: {message}", kind, r.status_code, code, retry_after)
+
+
+def _build_client() -> httpx.AsyncClient:
+    headers = {"Content-Type": "application/json"}
+    if META_ACCESS_TOKEN:
+        headers["Authorization"] = f"Bearer {META_ACCESS_TOKEN}"
+
+    return httpx.AsyncClient(
+        base_url=META_BASE_URL,
+        headers=headers,
+        timeout=META_TIMEOUT,
+        http2=META_HTTP2 and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=META_MAX_CONNECTIONS,
+            max_keepalive_connections=META_MAX_KEEPALIVE,
+            keepalive_expiry=META_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def start_meta_client():
+    """Cria o cliente compartilhado (chamado no startup do app)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def close_meta_client():
+    """Fecha as conexões abertas com a Meta (chamado no shutdown do app)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_meta_client() -> httpx.AsyncClient:
+    # fora do app (scripts) o cliente é criado na primeira chamada
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def _json_bytes(value) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+async def _post_message(phone_number_id: str, payload: dict) -> Optional[str]:
+    return await _post_body(phone_number_id, _json_bytes(payload))
+
+
+async def _post_body(phone_number_id: str, body: bytes) -> Optional[str]:
+    # body já serializado (Content-Type: application/json vem do cliente)
     if not META_ACCESS_TOKEN:
         raise RuntimeError("META_ACCESS_TOKEN não configurado no .env")
 
-    url = f"{META_BASE_URL}/{phone_number_id}/messages"
+    outcome = "ok"
+    start = time.perf_counter()
+    metrics.META_SENDS_IN_FLIGHT.inc()
+    try:
+        try:
+            r = await get_meta_client().post(f"/{phone_number_id}/messages", content=body)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            # a requisição nem saiu daqui
+            outcome = MetaSendError.RETRYABLE
+            raise MetaSendError(f"Sem conexão com a Meta: {e!r}", MetaSendError.RETRYABLE) from e
+        except httpx.TransportError as e:
+            outcome = MetaSendError.AMBIGUOUS
+            raise MetaSendError(f"Resposta da Meta não recebida: {e!r}", MetaSendError.AMBIGUOUS) from e
 
-    headers = {
-        "Authorization": f"Bearer {META_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
+        if r.is_error:
+            error = _classify_response(r)
+            outcome = error.kind
+            raise error
+    finally:
+        metrics.META_SENDS_IN_FLIGHT.dec()
+        if metrics.METRICS_ENABLED:
+            metrics.META_REQUEST_SECONDS.labels(phone_number_id, outcome).observe(time.perf_counter() - start)
+
+    data = r.json()
+
+    # sem id: None (e não ""), que fica NULL no banco, fora dos índices únicos de meta_message_id
+    msg_list = data.get("messages", [])
+    if msg_list:
+        return msg_list[0].get("id") or None
+
+    return None
+
+
+async def send_whatsapp_text(
+    to: str, text: str, phone_number_id: str, callback_data: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Envia mensagem de TEXTO pela API oficial da Meta.
+    Retorna o ID da mensagem gerado pela Meta (None se a resposta não trouxer).
 
+    - callback_data: volta nos webhooks de status (biz_opaque_callback_data)
+    """
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
@@ -33,17 +203,66 @@ async def send_whatsapp_text(to: str, text: str, phone_number_id: str) -> str:
             "body": text
         }
     }
+    if callback_data:
+        payload["biz_opaque_callback_data"] = callback_data
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        data = r.json()
+    return await _post_message(phone_number_id, payload)
 
-    msg_list = data.get("messages", [])
-    if msg_list:
-        return msg_list[0].get("id", "")
 
-    return ""
+class CompiledTemplate:
+    """
+    Payload de template pré-serializado, montado uma vez por campanha.
+
+    Numa campanha só o `to` (e às vezes os parâmetros do contato) muda entre
+    os envios: o resto do JSON fica pronto em bytes e render() só encaixa o
+    destinatário. Parâmetros iguais aos padrão reaproveitam o trecho pronto.
+    """
+
+    __slots__ = ("template_name", "language_code", "body_params", "_head", "_tail", "_default_tail")
+
+    _PREFIX = b'{"messaging_product":"whatsapp","to":'
+
+    def __init__(self, template_name: str, language_code: str = "pt_BR", body_params: Optional[Sequence[str]] = None):
+        self.template_name = template_name
+        self.language_code = language_code
+        self.body_params = list(body_params) if body_params else None
+
+        template = _json_bytes({"name": template_name, "language": {"code": language_code}})
+        # '...,"template":{"name":...,"language":{...}' sem o '}' final
+        self._head = b',"type":"template","template":' + template[:-1]
+        self._tail = b"}}"
+        self._default_tail = self._components_tail(self.body_params)
+
+    def _components_tail(self, body_params: Optional[Sequence[str]]) -> bytes:
+        if not body_params:
+            return self._head + self._tail
+        components = [{
+            "type": "body",
+            "parameters": [{"type": "text", "text": param} for param in body_params],
+        }]
+        return self._head + b',"components":' + _json_bytes(components) + self._tail
+
+    def render(self, to: str, body_params: Optional[Sequence[str]] = None,
+               callback_data: Optional[str] = None) -> bytes:
+        """JSON do envio para `to` (body_params do contato ou os padrão)."""
+        if not body_params or body_params == self.body_params:
+            tail = self._default_tail
+        else:
+            tail = self._components_tail(body_params)
+        if callback_data:
+            tail = b',"biz_opaque_callback_data":' + _json_bytes(callback_data) + tail
+        return self._PREFIX + _json_bytes(to) + tail
+
+
+async def send_compiled_template(
+    compiled: CompiledTemplate,
+    to: str,
+    phone_number_id: str,
+    body_params: Optional[Sequence[str]] = None,
+    callback_data: Optional[str] = None,
+) -> Optional[str]:
+    """Envia um template já compilado (ver CompiledTemplate). Retorna o ID da Meta."""
+    return await _post_body(phone_number_id, compiled.render(to, body_params, callback_data))
 
 
 async def send_whatsapp_template(
@@ -52,57 +271,15 @@ async def send_whatsapp_template(
     template_name: str,
     language_code: str = "pt_BR",
     body_params: Optional[List[str]] = None,
-) -> str:
+) -> Optional[str]:
     """
     Envia mensagem de TEMPLATE oficial pela API da Meta.
 
     - template_name: nome exato do template aprovado (ex: 'promo_black_friday')
     - language_code: código do idioma do template (ex: 'pt_BR')
     - body_params: lista para preencher {{1}}, {{2}}, ... no corpo do template
-    """
-    if not META_ACCESS_TOKEN:
-        raise RuntimeError("META_ACCESS_TOKEN não configurado no .env")
-
-    url = f"{META_BASE_URL}/{phone_number_id}/messages"
-
-    headers = {
-        "Authorization": f"Bearer {META_ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-
-    components = []
 
-    if body_params:
-        body_component = {
-            "type": "body",
-            "parameters": [
-                {"type": "text", "text": param} for param in body_params
-            ],
-        }
-        components.append(body_component)
-
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to,
-        "type": "template",
-        "template": {
-            "name": template_name,
-            "language": {
-                "code": language_code
-            },
-        },
-    }
-
-    if components:
-        payload["template"]["components"] = components
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        r = await client.post(url, headers=headers, json=payload)
-        r.raise_for_status()
-        data = r.json()
-
-    msg_list = data.get("messages", [])
-    if msg_list:
-        return msg_list[0].get("id", "")
-
-    return ""
+    Para muitos envios do mesmo template use CompiledTemplate + send_compiled_template.
+    """
+    compiled = CompiledTemplate(template_name, language_code, body_params)
+    return await send_compiled_template(compiled, to, phone_number_id)
@@ -0,0 +1,194 @@
+"""
+Métricas Prometheus (GET /metrics no app; METRICS_PORT no worker).
+
+Os rótulos incluem phone_number_id dos clientes, então nada é público por
+padrão: GET /metrics exige METRICS_TOKEN (ou um admin logado) e a porta do
+worker só escuta em METRICS_ADDR (127.0.0.1). METRICS_PUBLIC=true abre o
+/metrics sem autenticação.
+
+Histogramas: rotas HTTP, queries (por rótulo do comando: "UPDATE campaign_items"),
+espera por conexão do pool e chamadas à Meta (por phone_number_id e resultado).
+Contadores: envios de campanha gravados (sent/failed) e payloads de webhook.
+Gauges (lidos na hora da coleta): uso do pool, envios em andamento e fila do webhook.
+
+O custo por observação é um perf_counter e um lock curto; os rótulos das
+queries são calculados uma vez por texto de SQL (cache).
+"""
+import os
+import re
+import time
+from typing import Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# GET /metrics aceita "Authorization: Bearer <METRICS_TOKEN>" (para o Prometheus) ou o JWT de um admin
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").strip().lower() in ("1", "true", "yes")
+# interface da porta de métricas do worker (METRICS_PORT); 0.0.0.0 expõe para a rede
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+
+_FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Tempo até o início da resposta HTTP",
+    ["method", "route", "status"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Duração das queries", ["statement"], buckets=_FAST_BUCKETS,
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Espera por uma conexão livre do pool", buckets=_FAST_BUCKETS,
+)
+META_REQUEST_SECONDS = Histogram(
+    "meta_request_duration_seconds", "Chamadas à Graph API (envio de mensagens)",
+    ["phone_number_id", "outcome"],
+)
+META_SENDS_IN_FLIGHT = Gauge("meta_sends_in_flight", "Envios à Meta em andamento")
+CAMPAIGN_MESSAGES = Counter("campaign_messages_total", "Resultados de envio de campanha gravados", ["result"])
+WEBHOOK_PAYLOADS = Counter("webhook_payloads_total", "Payloads de webhook gravados no banco")
+WEBHOOK_INGEST_LAG_SECONDS = Histogram(
+    "webhook_ingest_lag_seconds", "Atraso entre receber o webhook e gravar no banco",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+
+# =======================
+# RÓTULO DAS QUERIES
+# =======================
+
+_TOKEN_RE = re.compile(r"--[^\n]*|'(?:[^']|'')*'|\(|\)|[A-Za-z_][\w.]*|\"[^\"]+\"")
+_VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE", "COPY", "CREATE", "ALTER", "DROP", "LISTEN"}
+_TABLE_AFTER = {"INSERT": "INTO", "DELETE": "FROM", "SELECT": "FROM", "COPY": None, "UPDATE": None}
+_LABELS_MAX = 2000
+
+_labels: Dict[str, str] = {}
+
+
+def _label(sql: str) -> str:
+    # comando principal (nível 0 de parênteses, depois dos CTEs do WITH) + tabela
+    depth = 0
+    verb = None
+    want = None
+    for m in _TOKEN_RE.finditer(sql):
+        tok = m.group(0)
+        if tok.startswith(("--", "'")):
+            continue
+        if tok == "(":
+            depth += 1
+            continue
+        if tok == ")":
+            depth -= 1
+            continue
+        if depth:
+            continue
+        word = tok.upper()
+        if verb is None:
+            if word in _VERBS:
+                verb = word
+                if verb not in _TABLE_AFTER:
+                    return verb
+                want = _TABLE_AFTER[verb]
+                if want is None:
+                    want = ""  # tabela logo em seguida
+            continue
+        if want == "":
+            return f"{verb} {tok.strip(chr(34)).lower()}"
+        if word == want:
+            want = ""
+    return verb or "OTHER"
+
+
+def statement_label(sql: str) -> str:
+    """"UPDATE campaign_items", "SELECT conversations"... (rótulo de baixa cardinalidade)."""
+    label = _labels.get(sql)
+    if label is None:
+        if len(_labels) >= _LABELS_MAX:
+            _labels.clear()  # SQL montado dinamicamente: não deixa o cache crescer sem limite
+        label = _labels[sql] = _label(sql)
+    return label
+
+
+def observe_query(sql: str, seconds: float):
+    if METRICS_ENABLED:
+        DB_QUERY_SECONDS.labels(statement_label(sql)).observe(seconds)
+
+
+def observe_pool_wait(seconds: float):
+    if METRICS_ENABLED:
+        DB_POOL_WAIT_SECONDS.observe(seconds)
+
+
+# =======================
+# GAUGES LIDOS NA COLETA
+# =======================
+
+class _StateCollector:
+    """Estado do pool e da fila do webhook, lido só quando o Prometheus coleta."""
+
+    def describe(self):
+        # sem describe() o registry chamaria collect() já no import
+        yield GaugeMetricFamily("db_pool_connections", "Conexões do pool por estado", labels=["state"])
+        yield GaugeMetricFamily("webhook_queue_depth", "Payloads aguardando gravação")
+
+    def collect(self):
+        from . import db, ingest_queue  # import tardio: db importa este módulo
+
+        pool = GaugeMetricFamily("db_pool_connections", "Conexões do pool por estado", labels=["state"])
+        for state, value in db.pool_stats().items():
+            pool.add_metric([state], value)
+        yield pool
+
+        queue = ingest_queue.stats()
+        yield GaugeMetricFamily("webhook_queue_depth", "Payloads aguardando gravação", value=queue["queue_depth"])
+
+
+REGISTRY.register(_StateCollector())
+
+
+# =======================
+# HTTP
+# =======================
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: tempo até o início da resposta, por rota (o template,
+    ex: /api/campaigns/{campaign_id}, não a URL). Streams (SSE, exportações)
+    contam só até o primeiro byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        observed = False
+
+        def observe(status):
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], path, str(status)).observe(time.perf_counter() - start)
+
+        async def send_wrapper(message):
+            nonlocal observed
+            if message["type"] == "http.response.start" and not observed:
+                observed = True
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            if not observed:
+                observe(500)
+            raise
+
+
+def render():
+    """(corpo, content-type) do /metrics."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -35,7 +35,7 @@ class Message(BaseModel):
     type: str               # "text", "image"... (por enquanto só text)
     text: Optional[str] = None
     wa_id: Optional[str] = None   # telefone do cliente
-    status: str = "sent"    # sent / received / read / failed
+    status: str = "sent"    # sent / delivered / read / failed (enviadas) ou received
     meta_message_id: Optional[str] = None
     timestamp: datetime
 
@@ -121,13 +121,17 @@ class Campaign(BaseModel):
     total: int = 0
     sent: int = 0
     failed: int = 0
+    delivered: int = 0      # status de entrega vindos do webhook (app/statuses.py)
+    read: int = 0
     status: CampaignStatus = CampaignStatus.pending
 
 
 class CampaignItemStatus(str, Enum):
     pending = "pending"
+    processing = "processing"   # alugado por um worker (app/worker.py)
     sent = "sent"
     failed = "failed"
+    unknown = "unknown"         # envio incerto (timeout): aguardando o status da Meta
 
 
 class CampaignItem(BaseModel):
@@ -135,6 +139,8 @@ class CampaignItem(BaseModel):
     campaign_id: str
     to: str
     status: CampaignItemStatus = CampaignItemStatus.pending
+    delivery_status: Optional[str] = None   # delivered / read / failed (webhook)
+    meta_message_id: Optional[str] = None
     error_message: Optional[str] = None
 
 
@@ -152,3 +158,15 @@ class CampaignCreate(BaseModel):
 
     # Lista de números (55119...)
     to_numbers: List[str]
+
+
+# =======================
+# DIAGNÓSTICO (ADMIN)
+# =======================
+
+class DiagnosticsUpdate(BaseModel):
+    # campos omitidos ficam como estão (ver app/profiling.py)
+    profile_sample_rate: Optional[float] = None   # 0..1 das requests com profiling
+    profile_min_ms: Optional[float] = None        # só grava profiles de requests mais lentas
+    slow_query_ms: Optional[float] = None         # 0 desliga o log de queries lentas
+    slow_query_explain: Optional[bool] = None
@@ -0,0 +1,49 @@
+"""
+Paginação por cursor (keyset) dos endpoints de listagem.
+
+O cursor é opaco para o cliente: base64 de "<timestamp iso>|<id>", a posição
+de uma linha na ordenação (timestamp, id). Os endpoints devolvem a lista como
+sempre e os cursores nos headers:
+
+    X-Cursor-Before  primeira linha da página (buscar anteriores)
+    X-Cursor-After   última linha da página (buscar seguintes)
+    X-Has-More       "true" se existe mais na direção paginada
+"""
+import base64
+import os
+import uuid
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, Response
+
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "500"))
+
+
+def page_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return PAGE_SIZE_DEFAULT
+    return max(1, min(limit, PAGE_SIZE_MAX))
+
+
+def encode_cursor(ts: Optional[datetime], row_id) -> str:
+    raw = f"{ts.isoformat() if ts else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.split("|", 1)
+        uuid.UUID(row_id)  # vai para o SQL como %s::uuid: cursor adulterado é 400, não 500
+        return (datetime.fromisoformat(ts) if ts else None), row_id
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def set_cursor_headers(response: Response, rows, has_more: bool, ts_field: str):
+    if rows:
+        response.headers["X-Cursor-Before"] = encode_cursor(rows[0][ts_field], rows[0]["id"])
+        response.headers["X-Cursor-After"] = encode_cursor(rows[-1][ts_field], rows[-1]["id"])
+    response.headers["X-Has-More"] = "true" if has_more else "false"
@@ -0,0 +1,44 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+
+_NON_DIGITS = re.compile(r"\D+")
+
+
+def normalize_number(raw: str) -> Optional[str]:
+    """
+    Deixa o número no formato que a Meta espera (só dígitos: 5511999998888).
+    Remove espaços, "+", "-", "(", ")" etc. Retorna None se ficar vazio.
+    """
+    if not raw:
+        return None
+    digits = _NON_DIGITS.sub("", raw)
+    return digits or None
+
+
+def normalize_e164(raw: str) -> Optional[str]:
+    """
+    Como normalize_number, mas só aceita números E.164 válidos: 8 a 15 dígitos
+    com código do país (não começa com 0). Retorna None se inválido.
+    """
+    num = normalize_number(raw)
+    if num is None or not 8 <= len(num) <= 15 or num[0] == "0":
+        return None
+    return num
+
+
+def dedupe_numbers(numbers: Iterable[str]) -> Tuple[List[str], List[Tuple[int, str]]]:
+    """
+    Normaliza (E.164, mesma regra do upload CSV) e remove duplicados/vazios,
+    mantendo a ordem original. Retorna (números válidos, [(posição, valor) inválidos]).
+    """
+    seen = {}
+    invalid = []
+    for i, raw in enumerate(numbers):
+        if not raw or not raw.strip():
+            continue
+        num = normalize_e164(raw)
+        if num is None:
+            invalid.append((i, raw))
+        else:
+            seen.setdefault(num, None)
+    return list(seen), invalid
@@ -0,0 +1,197 @@
+"""
+Diagnóstico sob demanda: profiling de requests por amostragem e log de queries lentas.
+
+Tudo desligado por padrão. Liga por env (PROFILE_SAMPLE_RATE, SLOW_QUERY_MS) ou
+em tempo de execução, sem restart, pelo PUT /api/admin/diagnostics (vale para o
+processo que atendeu a chamada).
+
+- Profiling: uma fração das requests (profile_sample_rate) roda sob o pyinstrument
+  (.html, entende async), se instalado, ou sob o cProfile (.prof, abrir com
+  snakeviz/pstats). O cProfile mede tudo que rodar no event loop durante a
+  request, então só uma request é medida por vez. Arquivos em PROFILE_DIR.
+- Queries lentas: acima de slow_query_ms vão para o log "app.slow_query" com a
+  forma dos parâmetros (tipos e tamanhos, nunca os valores), as linhas afetadas
+  e o EXPLAIN (sem ANALYZE: nada é executado de novo).
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from typing import List, Optional
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument  # opcional
+except ImportError:
+    _Pyinstrument = None
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))  # apaga os mais antigos
+_SKIP_PATHS = ("/api/events", "/metrics", "/static/")  # streams longos e ruído
+
+# alteráveis em tempo de execução (update_settings)
+settings = {
+    "profile_sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0")),    # 0..1
+    "profile_min_ms": float(os.getenv("PROFILE_MIN_MS", "0")),              # só grava requests mais lentas que isso
+    "slow_query_ms": float(os.getenv("SLOW_QUERY_MS", "0")),                # 0 = log desligado
+    "slow_query_explain": os.getenv("SLOW_QUERY_EXPLAIN", "true").strip().lower() in ("1", "true", "yes"),
+}
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("app.slow_query")
+
+_EXPLAINABLE = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "VALUES"}
+
+
+def update_settings(changes: dict) -> dict:
+    """Aplica as alterações (chaves de `settings`, valores None são ignorados)."""
+    for key, value in changes.items():
+        if key in settings and value is not None:
+            settings[key] = type(settings[key])(value)
+    return describe()
+
+
+def describe() -> dict:
+    return {
+        **settings,
+        "profiler": "pyinstrument" if _Pyinstrument else "cprofile",
+        "profile_dir": os.path.abspath(PROFILE_DIR),
+    }
+
+
+# =======================
+# QUERIES LENTAS
+# =======================
+
+def is_slow(seconds: float) -> bool:
+    threshold = settings["slow_query_ms"]
+    return threshold > 0 and seconds * 1000 >= threshold
+
+
+def explain_sql(sql: str) -> Optional[str]:
+    """O EXPLAIN da query, se fizer sentido (e estiver ligado)."""
+    if not settings["slow_query_explain"]:
+        return None
+    first = sql.lstrip().split(None, 1)[:1]
+    if not first or first[0].upper() not in _EXPLAINABLE:
+        return None
+    return "EXPLAIN " + sql
+
+
+def plan_lines(rows) -> List[str]:
+    return [next(iter(row.values())) for row in rows]
+
+
+def params_shape(params):
+    """Tipos e tamanhos dos parâmetros, sem os valores (que podem ter dados pessoais)."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _value_shape(v) for k, v in params.items()}
+    return [_value_shape(v) for v in params]
+
+
+def _value_shape(value) -> str:
+    if isinstance(value, (list, tuple)):
+        inner = type(value[0]).__name__ if value else "?"
+        return f"{type(value).__name__}[{inner} x{len(value)}]"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def log_slow_query(sql: str, params, seconds: float, rows: int, plan: Optional[List[str]]):
+    text = " ".join(sql.split())
+    if len(text) > 2000:
+        text = text[:2000] + "..."
+    message = "Query lenta: %.1f ms, %s linhas\n  sql: %s\n  params: %s"
+    args = [seconds * 1000, rows, text, params_shape(params)]
+    if plan:
+        message += "\n  plano:\n%s"
+        args.append("\n".join("    " + line for line in plan))
+    slow_logger.warning(message, *args)
+
+
+# =======================
+# PROFILING DE REQUESTS
+# =======================
+
+_profiling = False  # uma request por vez
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", text).strip("_")[:80] or "root"
+
+
+def _prune(directory: str):
+    files = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory)),
+        key=os.path.getmtime,
+    )
+    for path in files[:-PROFILE_MAX_FILES] if PROFILE_MAX_FILES > 0 else []:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _dump(profiler, name: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if _Pyinstrument is not None:
+        path = os.path.join(PROFILE_DIR, name + ".html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_html())
+    else:
+        path = os.path.join(PROFILE_DIR, name + ".prof")
+        profiler.dump_stats(path)
+    _prune(PROFILE_DIR)
+    logger.info("Profile gravado em %s", path)
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI: mede a request inteira de uma amostra das requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _profiling
+        rate = settings["profile_sample_rate"]
+        if (
+            scope["type"] != "http"
+            or rate <= 0
+            or _profiling
+            or scope["path"].startswith(_SKIP_PATHS)
+            or random.random() >= rate
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        _profiling = True
+        if _Pyinstrument is not None:
+            profiler = _Pyinstrument(async_mode="enabled")
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if _Pyinstrument is not None:
+                profiler.stop()
+            else:
+                profiler.disable()
+            _profiling = False
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= settings["profile_min_ms"]:
+                route = getattr(scope.get("route"), "path", None) or scope["path"]
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{_slug(route)}-{int(elapsed_ms)}ms"
+                try:
+                    await asyncio.to_thread(_dump, profiler, name)
+                except Exception:
+                    logger.exception("Falha ao gravar o profile da request")
@@ -0,0 +1,99 @@
+"""
+Tabela de roteamento phone_number_id -> user_id em memória.
+
+Carregada inteira do banco no startup e recarregada a cada ROUTING_REFRESH_INTERVAL
+segundos (ou quando `invalidate()` é chamado), para o webhook e os envios não
+precisarem consultar a tabela users a cada mensagem.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from .db import transaction
+
+ROUTING_REFRESH_INTERVAL = float(os.getenv("ROUTING_REFRESH_INTERVAL", "60"))
+# phone_number_id desconhecido força um reload, mas no máximo a cada X segundos
+ROUTING_MISS_REFRESH_MIN = float(os.getenv("ROUTING_MISS_REFRESH_MIN", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+class PhoneRoutingTable:
+    def __init__(self):
+        self._map: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    def get(self, phone_number_id: str) -> Optional[str]:
+        return self._map.get(str(phone_number_id)) if phone_number_id else None
+
+    async def refresh(self):
+        async with self._lock:
+            async with transaction() as tx:
+                rows = await tx.fetchall("""
+                    SELECT phone_number_id, id
+                    FROM users
+                    WHERE is_active = true AND phone_number_id IS NOT NULL
+                """)
+            # troca o dicionário inteiro de uma vez (leitores nunca veem meio carregado)
+            self._map = {str(row["phone_number_id"]): str(row["id"]) for row in rows}
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Força reload na próxima consulta (ex: usuário alterado neste processo)."""
+        self._loaded_at = None
+
+    def lookup(self, phone_number_ids: Iterable[str]) -> Dict[str, str]:
+        """Como resolve(), mas só com o que já está carregado (nunca abre transação)."""
+        ids = {str(p) for p in phone_number_ids if p}
+        return {p: self._map[p] for p in ids if p in self._map}
+
+    async def resolve(self, phone_number_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        phone_number_id -> user_id para os ids informados (sem query no caminho normal).
+
+        Pode recarregar a tabela (abre a própria transação): não chamar com uma
+        transação aberta, senão a mesma tarefa segura duas conexões do pool.
+        """
+        ids = {str(p) for p in phone_number_ids if p}
+
+        if not self.loaded:
+            await self.refresh()
+        elif any(p not in self._map for p in ids) and time.monotonic() - self._loaded_at > ROUTING_MISS_REFRESH_MIN:
+            # número novo cadastrado depois do último reload
+            await self.refresh()
+
+        return {p: self._map[p] for p in ids if p in self._map}
+
+    async def owner_of(self, phone_number_id: str) -> Optional[str]:
+        owners = await self.resolve([phone_number_id])
+        return owners.get(str(phone_number_id))
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(ROUTING_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Falha ao recarregar roteamento phone_number_id -> usuário")
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+routing_table = PhoneRoutingTable()
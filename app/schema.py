@@ -0,0 +1,207 @@
+import os
+
+from .db import transaction
+
+# Aplica as migrações abaixo no startup (app e worker)
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").strip().lower() in ("1", "true", "yes")
+
+# (id, comandos) em ordem. Cada migração roda uma única vez (tabela schema_migrations).
+# Nunca altere uma migração já publicada: crie outra.
+MIGRATIONS = [
+    ("001_campaign_queue", [
+        # fila de envio das campanhas (worker)
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0",
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS locked_by text",
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS locked_until timestamptz",
+        """
+        CREATE INDEX IF NOT EXISTS campaign_items_queue_idx
+        ON campaign_items (campaign_id, created_at)
+        WHERE status IN ('pending', 'processing')
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS campaigns_active_idx
+        ON campaigns (created_at)
+        WHERE status IN ('pending', 'running')
+        """,
+    ]),
+    ("002_conversations_user_wa_unique", [
+        # junta conversas duplicadas (mesmo user_id + wa_id) antes do índice único
+        """
+        WITH ranked AS (
+            SELECT id,
+                   first_value(id) OVER (PARTITION BY user_id, wa_id ORDER BY created_at, id) AS keep_id
+            FROM conversations
+            WHERE user_id IS NOT NULL
+        )
+        UPDATE messages AS m
+        SET conversation_id = r.keep_id
+        FROM ranked AS r
+        WHERE m.conversation_id = r.id AND r.id <> r.keep_id
+        """,
+        """
+        WITH ranked AS (
+            SELECT id,
+                   first_value(id) OVER (PARTITION BY user_id, wa_id ORDER BY created_at, id) AS keep_id
+            FROM conversations
+            WHERE user_id IS NOT NULL
+        )
+        DELETE FROM conversations AS c
+        USING ranked AS r
+        WHERE c.id = r.id AND r.id <> r.keep_id
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS conversations_user_wa_uidx
+        ON conversations (user_id, wa_id)
+        """,
+    ]),
+    ("003_webhook_spill", [
+        # payloads de webhook aguardando gravação (ver app/ingest_queue.py)
+        """
+        CREATE TABLE IF NOT EXISTS webhook_spill (
+            id bigserial PRIMARY KEY,
+            payload jsonb NOT NULL,
+            received_at timestamptz NOT NULL DEFAULT NOW(),
+            attempts integer NOT NULL DEFAULT 0,
+            last_error text
+        )
+        """,
+    ]),
+    ("004_messages_conversation_ts_idx", [
+        # paginação por cursor das mensagens (ver app/pagination.py)
+        """
+        CREATE INDEX IF NOT EXISTS messages_conversation_ts_idx
+        ON messages (conversation_id, timestamp, id)
+        """,
+    ]),
+    ("005_conversations_listing", [
+        # qualquer alteração na conversa atualiza updated_at (ETag / updated_since)
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT NOW()",
+        """
+        CREATE INDEX IF NOT EXISTS conversations_user_updated_idx
+        ON conversations (user_id, updated_at)
+        """,
+        # listagem paginada das conversas (mais recentes primeiro)
+        """
+        CREATE INDEX IF NOT EXISTS conversations_user_last_message_idx
+        ON conversations (user_id, last_message_at DESC NULLS LAST, id DESC)
+        """,
+    ]),
+    ("006_search_trgm", [
+        # busca de conversas (app/search.py); sem pg_trgm disponível a busca roda sem índice
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS conversations_name_trgm_idx
+                    ON conversations USING gin (name gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS conversations_wa_id_trgm_idx
+                    ON conversations USING gin (wa_id gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS messages_text_trgm_idx
+                    ON messages USING gin (text gin_trgm_ops);
+            ELSE
+                RAISE NOTICE 'pg_trgm indisponível: busca de conversas sem índice';
+            END IF;
+        END
+        $$
+        """,
+    ]),
+    ("007_campaign_items_listing", [
+        # listagem paginada (com e sem filtro de status) e resumo por status
+        """
+        CREATE INDEX IF NOT EXISTS campaign_items_campaign_status_idx
+        ON campaign_items (campaign_id, status, created_at, id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS campaign_items_campaign_created_idx
+        ON campaign_items (campaign_id, created_at, id)
+        """,
+    ]),
+    ("008_campaign_items_params", [
+        # parâmetros do template por contato (upload CSV, ver app/campaign_upload.py)
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS params text[]",
+    ]),
+    ("009_delivery_statuses", [
+        # status de entrega (app/statuses.py)
+        "ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS delivered integer NOT NULL DEFAULT 0",
+        "ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS read integer NOT NULL DEFAULT 0",
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS meta_message_id text",
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS delivery_status text",
+        # meta_message_id repetido (não deveria existir): mantém só na mensagem mais antiga
+        """
+        WITH ranked AS (
+            SELECT id,
+                   row_number() OVER (PARTITION BY meta_message_id ORDER BY created_at, id) AS n
+            FROM messages
+            WHERE meta_message_id IS NOT NULL
+        )
+        UPDATE messages AS m
+        SET meta_message_id = NULL
+        FROM ranked AS r
+        WHERE m.id = r.id AND r.n > 1
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS messages_meta_message_id_uidx
+        ON messages (meta_message_id)
+        WHERE meta_message_id IS NOT NULL
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS campaign_items_meta_message_id_uidx
+        ON campaign_items (meta_message_id)
+        WHERE meta_message_id IS NOT NULL
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS message_status_backlog (
+            meta_message_id text PRIMARY KEY,
+            status text NOT NULL,
+            error text,
+            received_at timestamptz NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    ("010_status_callback_data", [
+        # biz_opaque_callback_data do envio (chave de idempotência, ver dispatcher.py)
+        "ALTER TABLE message_status_backlog ADD COLUMN IF NOT EXISTS callback_data text",
+        """
+        CREATE INDEX IF NOT EXISTS message_status_backlog_callback_idx
+        ON message_status_backlog (callback_data)
+        WHERE callback_data IS NOT NULL
+        """,
+    ]),
+    ("011_campaign_items_unknown", [
+        # envio de resultado incerto (timeout): status 'unknown' até o webhook de status
+        # confirmar ou o prazo vencer (app/statuses.py, app/worker.py)
+        "ALTER TABLE campaign_items ADD COLUMN IF NOT EXISTS unknown_since timestamptz",
+        """
+        CREATE INDEX IF NOT EXISTS campaign_items_unknown_idx
+        ON campaign_items (unknown_since)
+        WHERE status = 'unknown'
+        """,
+    ]),
+]
+
+# chave qualquer, fixa: só um processo migra por vez
+_MIGRATION_LOCK_KEY = 7431001
+
+
+async def ensure_schema():
+    if not DB_AUTO_MIGRATE:
+        return
+
+    async with transaction() as tx:
+        await tx.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_KEY,))
+        await tx.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                id text PRIMARY KEY,
+                applied_at timestamptz NOT NULL DEFAULT NOW()
+            )
+        """)
+        rows = await tx.fetchall("SELECT id FROM schema_migrations")
+        applied = {row["id"] for row in rows}
+
+        for migration_id, statements in MIGRATIONS:
+            if migration_id in applied:
+                continue
+            for statement in statements:
+                await tx.execute(statement)
+            await tx.execute("INSERT INTO schema_migrations (id) VALUES (%s)", (migration_id,))
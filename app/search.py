@@ -0,0 +1,83 @@
+"""
+Busca de conversas no servidor (nome, wa_id e texto das mensagens).
+
+Com a extensão pg_trgm (migração 006) os ILIKE '%termo%' usam os índices GIN
+de trigramas e o ranking usa similarity()/word_similarity(). Sem a extensão a
+busca continua funcionando, só que sem índice e com ranking simples.
+"""
+import os
+from typing import Optional
+
+SEARCH_MIN_MESSAGE_TERM = int(os.getenv("SEARCH_MIN_MESSAGE_TERM", "3"))  # termos menores não varrem mensagens
+
+_trgm_available: Optional[bool] = None
+
+
+async def _has_trgm(tx) -> bool:
+    global _trgm_available
+    if _trgm_available is None:
+        row = await tx.fetchone("SELECT 1 AS ok FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trgm_available = row is not None
+    return _trgm_available
+
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+async def search_conversations(tx, user_id, term: str, limit: int, offset: int = 0):
+    """
+    Conversas do usuário que batem com `term`, mais relevantes primeiro.
+    Cada linha traz `score`, `match` ('contact' ou 'message') e `snippet`
+    (texto da mensagem encontrada, se for o caso). Busca limit + 1 linhas.
+    """
+    pattern = _like_pattern(term)
+    search_messages = len(term) >= SEARCH_MIN_MESSAGE_TERM
+
+    if await _has_trgm(tx):
+        contact_score = "GREATEST(similarity(c.name, %(term)s), similarity(c.wa_id, %(term)s))"
+        message_score = "word_similarity(%(term)s, m.text)"
+    else:
+        contact_score = "CASE WHEN c.name ILIKE %(prefix)s OR c.wa_id LIKE %(prefix)s THEN 1.0 ELSE 0.5 END"
+        message_score = "0.4"
+
+    message_hits = ""
+    if search_messages:
+        message_hits = f"""
+            UNION ALL
+            SELECT m.conversation_id, ({message_score}) * 0.8, 'message', m.text, m.timestamp
+            FROM messages AS m
+            JOIN conversations AS c ON c.id = m.conversation_id
+            WHERE c.user_id = %(user_id)s AND m.text ILIKE %(pattern)s
+        """
+
+    return await tx.fetchall(f"""
+        WITH hits AS (
+            SELECT c.id AS conversation_id, ({contact_score})::float8 AS score,
+                   'contact' AS match, NULL::text AS snippet, c.last_message_at AS matched_at
+            FROM conversations AS c
+            WHERE c.user_id = %(user_id)s
+              AND (c.name ILIKE %(pattern)s OR c.wa_id ILIKE %(pattern)s)
+            {message_hits}
+        ),
+        best AS (
+            -- um resultado por conversa: o melhor acerto (e a mensagem mais recente no empate)
+            SELECT DISTINCT ON (conversation_id) *
+            FROM hits
+            ORDER BY conversation_id, score DESC, matched_at DESC NULLS LAST
+        )
+        SELECT c.id, c.wa_id, c.name, c.last_message_text, c.last_message_at, c.unread_count, c.created_at,
+               b.score, b.match, LEFT(b.snippet, 200) AS snippet
+        FROM best AS b
+        JOIN conversations AS c ON c.id = b.conversation_id
+        ORDER BY b.score DESC, c.last_message_at DESC NULLS LAST, c.id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+    """, {
+        "user_id": user_id,
+        "term": term,
+        "pattern": pattern,
+        "prefix": _like_pattern(term)[1:],
+        "limit": limit + 1,
+        "offset": offset,
+    })
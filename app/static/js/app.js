@@ -52,7 +52,14 @@ async function api(url, options = {}) {
 // =======================
 
 let conversations = [];
+let conversationsCursorAfter = null;   // próxima página da lista
+let conversationsHasMore = false;
+let loadingMoreConversations = false;
 let selectedConversationId = null;
+let messages = [];
+let messagesCursorBefore = null;   // para buscar mensagens mais antigas
+let messagesHasMore = false;
+let loadingOlderMessages = false;
 
 // Carrega conversas
 async function loadConversations() {
@@ -61,7 +68,9 @@ async function loadConversations() {
         if (!res.ok) return;
 
         conversations = await res.json();
-        renderConversations(conversations);
+        conversationsCursorAfter = res.headers.get("X-Cursor-After");
+        conversationsHasMore = res.headers.get("X-Has-More") === "true";
+        renderFilteredConversations();
     } catch (e) {
         // se estiver deslogado, apiFetch já mostrou login
         // evita estourar erro no console/polling
@@ -69,6 +78,30 @@ async function loadConversations() {
     }
 }
 
+// Rolou até o fim da lista: busca a próxima página
+async function loadMoreConversations() {
+    if (!conversationsHasMore || !conversationsCursorAfter || loadingMoreConversations) return;
+
+    loadingMoreConversations = true;
+    try {
+        const cursor = encodeURIComponent(conversationsCursorAfter);
+        const res = await api(`/api/conversations?after=${cursor}`);
+        if (!res.ok) return;
+
+        const more = await res.json();
+        conversationsCursorAfter = res.headers.get("X-Cursor-After") || conversationsCursorAfter;
+        conversationsHasMore = res.headers.get("X-Has-More") === "true";
+
+        const known = new Set(conversations.map(c => c.id));
+        conversations = conversations.concat(more.filter(c => !known.has(c.id)));
+        renderFilteredConversations();
+    } catch (e) {
+        // console.warn("loadMoreConversations:", e);
+    } finally {
+        loadingMoreConversations = false;
+    }
+}
+
 // Renderiza lista de conversas
 function renderConversations(list) {
     const container = document.getElementById("conversations-list");
@@ -87,7 +120,7 @@ function renderConversations(list) {
 
         const lastMsg = document.createElement("div");
         lastMsg.className = "conversation-last-message";
-        lastMsg.textContent = conv.last_message_text || "";
+        lastMsg.textContent = conv.snippet || conv.last_message_text || "";  // snippet: mensagem achada na busca
 
         item.appendChild(title);
         item.appendChild(lastMsg);
@@ -113,24 +146,50 @@ async function selectConversation(id, conv) {
     await loadMessages(id);
 }
 
-// Carrega mensagens da conversa
+// Carrega mensagens da conversa (só a página mais recente)
 async function loadMessages(conversationId) {
     try {
         const res = await api(`/api/conversations/${conversationId}/messages`);
         if (!res.ok) return;
 
-        const msgs = await res.json();
-        renderMessages(msgs);
+        messages = await res.json();
+        messagesCursorBefore = res.headers.get("X-Cursor-Before");
+        messagesHasMore = res.headers.get("X-Has-More") === "true";
+        renderMessages(messages);
     } catch (e) {
         // console.warn("loadMessages:", e);
     }
 }
 
+// Rolou até o topo: busca a página anterior
+async function loadOlderMessages() {
+    if (!selectedConversationId || !messagesHasMore || !messagesCursorBefore || loadingOlderMessages) return;
+
+    const conversationId = selectedConversationId;
+    loadingOlderMessages = true;
+    try {
+        const cursor = encodeURIComponent(messagesCursorBefore);
+        const res = await api(`/api/conversations/${conversationId}/messages?before=${cursor}`);
+        if (!res.ok || conversationId !== selectedConversationId) return;
+
+        const older = await res.json();
+        messagesCursorBefore = res.headers.get("X-Cursor-Before") || messagesCursorBefore;
+        messagesHasMore = res.headers.get("X-Has-More") === "true";
+        messages = older.concat(messages);
+        renderMessages(messages, { keepScroll: true });
+    } catch (e) {
+        // console.warn("loadOlderMessages:", e);
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
 // Renderiza mensagens
-function renderMessages(msgs) {
+function renderMessages(msgs, { keepScroll = false } = {}) {
     const container = document.getElementById("messages-container");
     if (!container) return;
 
+    const fromBottom = container.scrollHeight - container.scrollTop;
     container.innerHTML = "";
 
     (msgs || []).forEach(m => {
@@ -156,7 +215,8 @@ function renderMessages(msgs) {
         container.appendChild(row);
     });
 
-    container.scrollTop = container.scrollHeight;
+    // ao carregar anteriores, mantém a mensagem que estava na tela no lugar
+    container.scrollTop = keepScroll ? container.scrollHeight - fromBottom : container.scrollHeight;
 }
 
 // Envia mensagem
@@ -209,35 +269,72 @@ async function sendMessage() {
     }
 }
 
-// Busca conversas
+// Busca conversas (no servidor: nome, número e texto das mensagens)
+let searchResults = [];
+let searchTimer = null;
+let searchSeq = 0;
+
+function searchTerm() {
+    return (document.getElementById("search-input")?.value || "").trim();
+}
+
+async function runSearch() {
+    const term = searchTerm();
+    const seq = ++searchSeq;
+    if (!term) {
+        renderFilteredConversations();
+        return;
+    }
+
+    try {
+        const res = await api(`/api/conversations/search?q=${encodeURIComponent(term)}`);
+        if (!res.ok || seq !== searchSeq) return;   // chegou resposta de uma busca antiga
+
+        searchResults = await res.json();
+        renderFilteredConversations();
+    } catch (e) {
+        // console.warn("runSearch:", e);
+    }
+}
+
 function setupSearch() {
     const input = document.getElementById("search-input");
     if (!input) return;
 
     input.addEventListener("input", () => {
-        const term = input.value.toLowerCase();
-        const filtered = conversations.filter(c =>
-            (c.name || "").toLowerCase().includes(term) ||
-            (c.wa_id || "").toLowerCase().includes(term)
-        );
-        renderConversations(filtered);
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(runSearch, 300);
     });
 }
 
-// Polling para atualizar conversas/mensagens
-function setupChatPolling() {
-    setInterval(async () => {
-        try {
-            await loadConversations();
-            if (selectedConversationId) {
-                await loadMessages(selectedConversationId);
-            }
-        } catch (e) {
-            // ignora
-        }
-    }, 5000);
+// Lista atual: resultado da busca (se tiver termo) ou todas as conversas
+function renderFilteredConversations() {
+    renderConversations(searchTerm() ? searchResults : conversations);
 }
 
+// Evento conversation.updated: atualiza/insere e reordena pela última mensagem
+function applyConversationUpdate(conv) {
+    const i = conversations.findIndex(c => c.id === conv.id);
+    if (i >= 0) {
+        conversations[i] = { ...conversations[i], ...conv };
+    } else {
+        conversations.push(conv);
+    }
+    const j = searchResults.findIndex(c => c.id === conv.id);
+    if (j >= 0) searchResults[j] = { ...searchResults[j], ...conv };
+    conversations.sort((a, b) =>
+        new Date(b.last_message_at || 0) - new Date(a.last_message_at || 0)
+    );
+    renderFilteredConversations();
+}
+
+// Evento message.new: só interessa se for da conversa aberta
+function applyNewMessage(msg) {
+    if (msg.conversation_id !== selectedConversationId) return;
+    if (messages.some(m => m.id === msg.id)) return;
+    messages.push(msg);
+    renderMessages(messages);
+}
 
 // =======================
 // CAMPANHAS
@@ -275,14 +372,17 @@ async function startCampaign() {
     const phoneEl = document.getElementById("campaign-phone-number-id");
     const numbersEl = document.getElementById("campaign-numbers");
 
+    const fileEl = document.getElementById("campaign-file");
+
     const name = (nameEl?.value || "").trim();
     const phoneNumberId = (phoneEl?.value || "").trim();
     const numbersText = (numbersEl?.value || "").trim();
+    const file = fileEl?.files?.[0] || null;
 
     const mode = getCampaignMode();
 
-    if (!name || !phoneNumberId || !numbersText) {
-        alert("Preencha nome, PHONE_NUMBER_ID e os números.");
+    if (!name || !phoneNumberId || (!numbersText && !file)) {
+        alert("Preencha nome, PHONE_NUMBER_ID e os números (ou escolha um CSV).");
         return;
     }
 
@@ -340,11 +440,27 @@ async function startCampaign() {
     }
 
     try {
-        const res = await api("/api/campaigns", {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify(body)
-        });
+        let res;
+        if (file) {
+            // lista grande: vai o arquivo, o servidor lê em blocos
+            const form = new FormData();
+            form.append("file", file);
+            form.append("name", body.name);
+            form.append("phone_number_id", body.phone_number_id);
+            if (body.message_text) form.append("message_text", body.message_text);
+            if (body.template_name) {
+                form.append("template_name", body.template_name);
+                form.append("template_language_code", body.template_language_code);
+                form.append("template_body_params", (body.template_body_params || []).join("\n"));
+            }
+            res = await api("/api/campaigns/upload", { method: "POST", body: form });
+        } else {
+            res = await api("/api/campaigns", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify(body)
+            });
+        }
 
         if (!res.ok) {
             const err = await res.text();
@@ -352,40 +468,82 @@ async function startCampaign() {
             return;
         }
 
+        const result = await res.json();
+        if (result.error) {
+            alert("Erro ao criar campanha: " + result.error);
+            return;
+        }
+        if (result.invalid || result.duplicates) {
+            alert(`Campanha criada com ${result.total} contatos (${result.invalid} inválidos, ${result.duplicates} duplicados ignorados).`);
+        }
+        if (fileEl) fileEl.value = "";
+
         await loadCampaigns();
     } catch (e) {
         // console.warn("startCampaign:", e);
     }
 }
 
-async function loadCampaigns() {
-    const container = document.getElementById("campaigns-status");
-    if (!container) return;
+let campaigns = [];
 
+async function loadCampaigns() {
     try {
         const res = await api("/api/campaigns");
         if (!res.ok) return;
 
-        const list = await res.json();
+        campaigns = await res.json();
+        renderCampaigns(campaigns);
+    } catch (e) {
+        // console.warn("loadCampaigns:", e);
+    }
+}
 
-        container.innerHTML = "";
+function renderCampaigns(list) {
+    const container = document.getElementById("campaigns-status");
+    if (!container) return;
 
-        (list || []).forEach(c => {
-            const div = document.createElement("div");
-            div.className = "campaign-status-item";
+    container.innerHTML = "";
 
-            const created = c.created_at ? new Date(c.created_at).toLocaleString("pt-BR") : "";
-            div.textContent = `${c.name} - ${c.status} | Enviados: ${c.sent}/${c.total} | Falhas: ${c.failed} | Criada em: ${created}`;
+    (list || []).forEach(c => {
+        const div = document.createElement("div");
+        div.className = "campaign-status-item";
 
-            container.appendChild(div);
-        });
-    } catch (e) {
-        // console.warn("loadCampaigns:", e);
+        const created = c.created_at ? new Date(c.created_at).toLocaleString("pt-BR") : "";
+        div.textContent = `${c.name} - ${c.status} | Enviados: ${c.sent}/${c.total} | Entregues: ${c.delivered || 0} | Lidos: ${c.read || 0} | Falhas: ${c.failed} | Criada em: ${created}`;
+
+        container.appendChild(div);
+    });
+}
+
+// Evento campaign.progress: atualiza contadores/status da campanha
+function applyCampaignProgress(camp) {
+    const i = campaigns.findIndex(c => c.id === camp.id);
+    if (i < 0) {
+        // campanha que ainda não está na lista (ex: criada em outra aba)
+        loadCampaigns();
+        return;
     }
+    campaigns[i] = { ...campaigns[i], ...camp };
+    renderCampaigns(campaigns);
 }
 
-function setupCampaignPolling() {
-    setInterval(loadCampaigns, 5000);
+
+// =======================
+// TEMPO REAL
+// =======================
+
+// Substitui o polling: o servidor empurra os eventos (ver events.js)
+function setupRealtime() {
+    subscribeEvents({
+        "message.new": applyNewMessage,
+        "conversation.updated": applyConversationUpdate,
+        "campaign.progress": applyCampaignProgress,
+        "resync": async () => {
+            await loadConversations();
+            if (selectedConversationId) await loadMessages(selectedConversationId);
+            await loadCampaigns();
+        },
+    });
 }
 
 
@@ -411,7 +569,21 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
     setupSearch();
-    setupChatPolling();
+
+    const conversationsList = document.getElementById("conversations-list");
+    if (conversationsList) {
+        conversationsList.addEventListener("scroll", () => {
+            const end = conversationsList.scrollHeight - conversationsList.clientHeight - 50;
+            if (conversationsList.scrollTop >= end) loadMoreConversations();
+        });
+    }
+
+    const messagesContainer = document.getElementById("messages-container");
+    if (messagesContainer) {
+        messagesContainer.addEventListener("scroll", () => {
+            if (messagesContainer.scrollTop === 0) loadOlderMessages();
+        });
+    }
 
     await loadConversations();
 
@@ -422,6 +594,8 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
     setupCampaignModeSwitch();
-    setupCampaignPolling();
     await loadCampaigns();
+
+    // depois da carga inicial, só eventos
+    setupRealtime();
 });
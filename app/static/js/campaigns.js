@@ -112,13 +112,17 @@ async function loadCampaigns() {
 
         const created = c.created_at ? new Date(c.created_at).toLocaleString("pt-BR") : "";
 
-        div.textContent = `${c.name} - ${c.status} | Enviados: ${c.sent}/${c.total} | Falhas: ${c.failed} | Criada em: ${created}`;
+        div.textContent = `${c.name} - ${c.status} | Enviados: ${c.sent}/${c.total} | Entregues: ${c.delivered || 0} | Lidos: ${c.read || 0} | Falhas: ${c.failed} | Criada em: ${created}`;
         container.appendChild(div);
     });
 }
 
-function setupCampaignPolling() {
-    setInterval(loadCampaigns, 5000);
+// Atualiza só quando o servidor avisa que algo mudou (ver events.js)
+function setupRealtime() {
+    subscribeEvents({
+        "campaign.progress": loadCampaigns,
+        "resync": loadCampaigns,
+    });
 }
 
 document.addEventListener("DOMContentLoaded", async () => {
@@ -128,6 +132,6 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
     setupCampaignModeSwitch();
-    setupCampaignPolling();
     await loadCampaigns();
+    setupRealtime();
 });
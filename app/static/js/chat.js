@@ -149,14 +149,22 @@ function setupSearch() {
     });
 }
 
-// Polling para atualizar conversas/mensagens
-function setupPolling() {
-    setInterval(async () => {
-        await loadConversations();
-        if (selectedConversationId) {
+// Atualiza só quando o servidor avisa que algo mudou (ver events.js)
+function setupRealtime() {
+    const refreshMessages = async (msg) => {
+        if (selectedConversationId && (!msg || msg.conversation_id === selectedConversationId)) {
             await loadMessages(selectedConversationId);
         }
-    }, 5000);
+    };
+
+    subscribeEvents({
+        "message.new": refreshMessages,
+        "conversation.updated": loadConversations,
+        "resync": async () => {
+            await loadConversations();
+            await refreshMessages(null);
+        },
+    });
 }
 
 // Inicialização
@@ -174,6 +182,6 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 
     setupSearch();
-    setupPolling();
     await loadConversations();
+    setupRealtime();
 });
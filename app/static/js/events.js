@@ -0,0 +1,79 @@
+// =======================
+// TEMPO REAL (SSE em /api/events)
+// =======================
+
+// EventSource não manda header Authorization, então lemos o stream via fetch
+// (window.apiFetch quando existir) e interpretamos o formato SSE aqui.
+//
+// handlers: { "message.new": fn(data), "conversation.updated": fn(data),
+//             "campaign.progress": fn(data), "resync": fn() }
+// "resync" também é chamado a cada reconexão (pode ter perdido eventos).
+function subscribeEvents(handlers) {
+    let retryMs = 3000;
+    let connectedOnce = false;
+
+    function dispatchEvent(type, dataText) {
+        const fn = handlers[type];
+        if (!fn) return;
+
+        let data = null;
+        try {
+            data = dataText ? JSON.parse(dataText) : null;
+        } catch (e) {
+            return;
+        }
+        try {
+            fn(data);
+        } catch (e) {
+            // console.warn("handler", type, e);
+        }
+    }
+
+    async function connect() {
+        try {
+            const doFetch = window.apiFetch || fetch;
+            const res = await doFetch("/api/events", {
+                headers: { "Accept": "text/event-stream" }
+            });
+            if (!res.ok || !res.body) throw new Error("SSE " + res.status);
+
+            if (connectedOnce) dispatchEvent("resync", "");
+            connectedOnce = true;
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+
+                // eventos são separados por linha em branco
+                let sep;
+                while ((sep = buffer.indexOf("\n\n")) >= 0) {
+                    const block = buffer.slice(0, sep);
+                    buffer = buffer.slice(sep + 2);
+
+                    let type = "message";
+                    const dataLines = [];
+                    block.split("\n").forEach(line => {
+                        if (line.startsWith(":")) return; // ping
+                        if (line.startsWith("event:")) type = line.slice(6).trim();
+                        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+                        else if (line.startsWith("retry:")) retryMs = parseInt(line.slice(6), 10) || retryMs;
+                    });
+
+                    if (dataLines.length) dispatchEvent(type, dataLines.join("\n"));
+                }
+            }
+        } catch (e) {
+            // deslogado (apiFetch já mostrou login) ou conexão caiu
+        }
+
+        setTimeout(connect, retryMs);
+    }
+
+    connect();
+}
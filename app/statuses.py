@@ -0,0 +1,272 @@
+"""
+Status de entrega das mensagens enviadas (value.statuses do webhook da Meta).
+
+sent -> delivered -> read (ou failed). Os status são aplicados por
+meta_message_id, em lote, nas mensagens do chat (messages.status) e nos itens
+de campanha (campaign_items.delivery_status), e só avançam: um "delivered"
+atrasado não desfaz um "read". Os contadores delivered/read da campanha são
+incrementados na mesma query, só pelas transições que realmente aconteceram.
+
+O webhook pode chegar antes de o meta_message_id estar gravado (o resultado da
+campanha é gravado em lote). Status sem dono vão para message_status_backlog
+e são aplicados quando o id for gravado (apply_status_backlog). Quem grava o
+id e quem recebe o status travam o id antes (lock_status_keys): sem isso, as
+duas transações simultâneas não veem o que a outra ainda não commitou e o
+status fica esquecido no backlog.
+
+O backlog também guarda o biz_opaque_callback_data do envio: o worker manda o
+id do item nesse campo. Envio de resultado incerto (timeout, worker que caiu)
+nunca é repetido: o item fica 'unknown' sem meta_message_id e, quando chega um
+status com o id dele no callback_data, vira 'sent' (resolve_unknown_items).
+Sem status até STATUS_BACKLOG_MAX_AGE, o worker o dá como falho.
+"""
+import os
+import uuid
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from . import metrics
+from .events import publish
+
+# status sem mensagem correspondente ficam guardados no máximo este tempo
+STATUS_BACKLOG_MAX_AGE = float(os.getenv("STATUS_BACKLOG_MAX_AGE", "86400"))
+
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+# mesma ordem em SQL (coluna atual -> rank)
+_RANK_SQL = "CASE {col} WHEN 'sent' THEN 1 WHEN 'delivered' THEN 2 WHEN 'read' THEN 3 WHEN 'failed' THEN 4 ELSE 0 END"
+
+CAMPAIGN_PROGRESS_COLUMNS = "id, user_id, name, total, sent, failed, delivered, read, status"
+
+# namespace do pg_advisory_xact_lock(int, int) de lock_status_keys
+_STATUS_LOCK_NS = 7431020
+
+
+async def lock_status_keys(tx, keys: Iterable[Optional[str]]):
+    """
+    Trava (até o fim da transação) os meta_message_id informados.
+
+    Chamar ANTES de gravar um meta_message_id novo e antes de aplicar status
+    recebidos; em ordem de hash, para duas transações nunca travarem em ordem
+    inversa.
+    """
+    keys = sorted({k for k in keys if k})
+    if not keys:
+        return
+    await tx.execute("""
+        SELECT pg_advisory_xact_lock(%s, h)
+        FROM (SELECT DISTINCT hashtext(k) AS h FROM unnest(%s::text[]) AS k ORDER BY 1) AS t
+    """, (_STATUS_LOCK_NS, keys))
+
+
+def parse_statuses(payload: dict) -> List[dict]:
+    """Extrai os status de entrega de um payload de webhook."""
+    out = []
+    for entry in payload.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+            for st in value.get("statuses", []) or []:
+                status = st.get("status")
+                if not st.get("id") or status not in STATUS_RANK:
+                    continue
+
+                error = None
+                errors = st.get("errors") or []
+                if status == "failed" and errors:
+                    err = errors[0] or {}
+                    error = f"{err.get('code')}: {err.get('title') or err.get('message') or ''}".strip()
+
+                out.append({
+                    "meta_id": st["id"],
+                    "status": status,
+                    "error": error,
+                    "callback": st.get("biz_opaque_callback_data"),
+                })
+    return out
+
+
+def _latest(statuses: Iterable[dict]) -> Dict[str, dict]:
+    # vários status do mesmo id no lote: fica o mais avançado
+    best: Dict[str, dict] = {}
+    for st in statuses:
+        cur = best.get(st["meta_id"])
+        if cur is None or STATUS_RANK[st["status"]] > STATUS_RANK[cur["status"]]:
+            best[st["meta_id"]] = st
+    return best
+
+
+async def apply_statuses(tx, statuses: Iterable[dict], keep_unmatched: bool = True) -> int:
+    """Aplica os status (dentro da transação `tx`). Retorna quantas linhas mudaram."""
+    latest = _latest(statuses)
+    if not latest:
+        return 0
+
+    # ordem fixa: webhooks concorrentes travam as linhas na mesma ordem
+    meta_ids = sorted(latest)
+    callbacks = [latest[m].get("callback") for m in meta_ids]
+    if keep_unmatched:
+        # status recebido do webhook: espera quem está gravando estes ids (ou
+        # deixando estes itens 'unknown') commitar; quem chama com
+        # keep_unmatched=False já travou, ver apply_status_backlog
+        await lock_status_keys(tx, meta_ids + callbacks)
+    params = (
+        meta_ids,
+        [latest[m]["status"] for m in meta_ids],
+        [latest[m]["error"] for m in meta_ids],
+    )
+
+    messages = await tx.fetchall(f"""
+        WITH s AS (
+            SELECT * FROM unnest(%s::text[], %s::text[], %s::text[]) AS s(meta_id, status, error)
+        )
+        UPDATE messages AS m
+        SET status = s.status
+        FROM s
+        WHERE m.meta_message_id = s.meta_id
+          AND ({_RANK_SQL.format(col="m.status")}) < ({_RANK_SQL.format(col="s.status")})
+        RETURNING m.id
+    """, params)
+
+    campaigns = await tx.fetchall(f"""
+        WITH s AS (
+            SELECT * FROM unnest(%s::text[], %s::text[], %s::text[]) AS s(meta_id, status, error)
+        ),
+        changed AS (
+            SELECT ci.id, ci.campaign_id, s.status, s.error,
+                   ({_RANK_SQL.format(col="ci.delivery_status")}) AS old_rank,
+                   ({_RANK_SQL.format(col="s.status")}) AS new_rank
+            FROM campaign_items AS ci
+            JOIN s ON ci.meta_message_id = s.meta_id
+            WHERE ({_RANK_SQL.format(col="ci.delivery_status")}) < ({_RANK_SQL.format(col="s.status")})
+            ORDER BY ci.id
+            FOR UPDATE OF ci
+        ),
+        upd AS (
+            UPDATE campaign_items AS ci
+            SET delivery_status = c.status,
+                error_message = COALESCE(c.error, ci.error_message)
+            FROM changed AS c
+            WHERE ci.id = c.id
+        )
+        UPDATE campaigns AS cp
+        SET delivered = cp.delivered + d.delivered,
+            read = cp.read + d.read
+        FROM (
+            SELECT campaign_id,
+                   COUNT(*) FILTER (WHERE old_rank < 2 AND new_rank IN (2, 3)) AS delivered,
+                   COUNT(*) FILTER (WHERE new_rank = 3) AS read,
+                   COUNT(*) AS n
+            FROM changed
+            GROUP BY campaign_id
+        ) AS d
+        WHERE cp.id = d.campaign_id
+        RETURNING cp.id, cp.user_id, cp.name, cp.total, cp.sent, cp.failed, cp.delivered, cp.read, cp.status, d.n
+    """, params)
+
+    changed = len(messages)
+    for camp in campaigns:
+        changed += camp.pop("n")
+        publish(tx, camp["user_id"], "campaign.progress", camp)
+
+    if keep_unmatched:
+        await tx.execute(f"""
+            WITH s AS (
+                SELECT *
+                FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[]) AS s(meta_id, status, error, callback)
+            )
+            INSERT INTO message_status_backlog (meta_message_id, status, error, callback_data)
+            SELECT s.meta_id, s.status, s.error, s.callback
+            FROM s
+            WHERE NOT EXISTS (SELECT 1 FROM messages AS m WHERE m.meta_message_id = s.meta_id)
+              AND NOT EXISTS (SELECT 1 FROM campaign_items AS ci WHERE ci.meta_message_id = s.meta_id)
+            ON CONFLICT (meta_message_id) DO UPDATE
+            SET status = EXCLUDED.status, error = EXCLUDED.error, received_at = NOW(),
+                callback_data = COALESCE(EXCLUDED.callback_data, message_status_backlog.callback_data)
+            WHERE ({_RANK_SQL.format(col="message_status_backlog.status")})
+                < ({_RANK_SQL.format(col="EXCLUDED.status")})
+        """, params + (callbacks,))
+
+        # envios incertos que este status confirma
+        changed += await resolve_unknown_items(tx, callbacks)
+
+    return changed
+
+
+async def apply_status_backlog(tx, meta_ids: List[str]) -> int:
+    """
+    Aplica status que chegaram antes destes meta_message_id serem gravados.
+
+    A transação deve ter chamado lock_status_keys(tx, meta_ids) antes de gravar os ids.
+    """
+    meta_ids = [m for m in meta_ids if m]
+    if not meta_ids:
+        return 0
+    rows = await tx.fetchall("""
+        DELETE FROM message_status_backlog
+        WHERE meta_message_id = ANY(%s::text[])
+        RETURNING meta_message_id AS meta_id, status, error
+    """, (meta_ids,))
+    if not rows:
+        return 0
+    return await apply_statuses(tx, rows, keep_unmatched=False)
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+async def resolve_unknown_items(tx, item_ids: Iterable[Optional[str]]) -> int:
+    """
+    Itens 'unknown' destes ids com status já recebido (callback_data = id do
+    item): viram 'sent' com o meta_message_id do status, que é aplicado em
+    seguida. A transação deve ter chamado lock_status_keys(tx, item_ids).
+    """
+    ids = sorted({i for i in item_ids if i and _is_uuid(i)})
+    if not ids:
+        return 0
+    rows = await tx.fetchall("""
+        WITH found AS (
+            SELECT DISTINCT ON (callback_data) callback_data, meta_message_id
+            FROM message_status_backlog
+            WHERE callback_data = ANY(%s::text[])
+            ORDER BY callback_data, received_at
+        )
+        UPDATE campaign_items AS ci
+        SET status = 'sent',
+            meta_message_id = f.meta_message_id,
+            error_message = NULL,
+            unknown_since = NULL
+        FROM found AS f
+        WHERE ci.id = f.callback_data::uuid
+          AND ci.status = 'unknown'
+        RETURNING ci.campaign_id, ci.meta_message_id
+    """, (ids,))
+    if not rows:
+        return 0
+
+    sent = Counter(str(row["campaign_id"]) for row in rows)
+    campaigns = await tx.fetchall(f"""
+        UPDATE campaigns
+        SET sent = sent + d.n
+        FROM unnest(%s::uuid[], %s::int[]) AS d(campaign_id, n)
+        WHERE campaigns.id = d.campaign_id
+        RETURNING {CAMPAIGN_PROGRESS_COLUMNS}
+    """, (list(sent), list(sent.values())))
+    for camp in campaigns:
+        publish(tx, camp["user_id"], "campaign.progress", camp)
+    tx.on_commit(lambda: metrics.CAMPAIGN_MESSAGES.labels("sent").inc(len(rows)))
+
+    await apply_status_backlog(tx, [row["meta_message_id"] for row in rows])
+    return len(rows)
+
+
+async def purge_status_backlog(tx, max_age: float = STATUS_BACKLOG_MAX_AGE) -> int:
+    """Descarta status órfãos antigos (mensagens enviadas por fora do painel, etc.)."""
+    return await tx.execute(
+        "DELETE FROM message_status_backlog WHERE received_at < NOW() - make_interval(secs => %s)",
+        (max_age,),
+    )
@@ -0,0 +1,188 @@
+"""
+Ingestão dos webhooks da Meta em poucas queries (independe do nº de mensagens):
+
+1. resolve os donos (users) de todos os phone_number_id do lote (em memória, app/routing.py),
+   antes de abrir a transação (resolve_owners)
+2. upsert das conversas (INSERT ... ON CONFLICT), já com last_message/unread agregados
+3. um INSERT multi-linhas com todas as mensagens
+4. status de entrega (value.statuses) aplicados em lote (app/statuses.py)
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .db import transaction
+from .routing import routing_table
+from .events import publish
+from .statuses import parse_statuses, apply_statuses
+
+
+def parse_incoming_messages(payload: dict) -> List[dict]:
+    """Extrai as mensagens recebidas de um payload de webhook, na ordem em que vieram."""
+    out = []
+    for entry in payload.get("entry", []) or []:
+        for change in entry.get("changes", []) or []:
+            value = change.get("value", {}) or {}
+
+            metadata = value.get("metadata", {}) or {}
+            phone_number_id = metadata.get("phone_number_id")
+
+            for msg in value.get("messages", []) or []:
+                ts_str = msg.get("timestamp", "0")
+                try:
+                    ts = int(ts_str)
+                except (TypeError, ValueError):
+                    ts = int(datetime.utcnow().timestamp())
+
+                out.append({
+                    "phone_number_id": str(phone_number_id) if phone_number_id else None,
+                    "wa_id": msg.get("from"),  # telefone 5511...
+                    "text": (msg.get("text") or {}).get("body", ""),
+                    "ts": ts,
+                })
+    return out
+
+
+def _aggregate(messages: List[dict]) -> Dict[Tuple[Optional[str], str], dict]:
+    # uma linha por conversa: última mensagem (maior timestamp) + quantas chegaram
+    convs: Dict[Tuple[Optional[str], str], dict] = {}
+    for m in messages:
+        key = (m["user_id"], m["wa_id"])
+        agg = convs.get(key)
+        if agg is None:
+            convs[key] = {"text": m["text"], "ts": m["ts"], "count": 1}
+            continue
+        agg["count"] += 1
+        if m["ts"] >= agg["ts"]:
+            agg["text"], agg["ts"] = m["text"], m["ts"]
+    return convs
+
+
+async def _upsert_conversations(tx, convs) -> Dict[Tuple[Optional[str], str], dict]:
+    # ordem fixa das chaves: webhooks concorrentes travam as conversas na mesma ordem (sem deadlock)
+    owned = sorted(((k, v) for k, v in convs.items() if k[0] is not None), key=lambda kv: kv[0])
+    orphan = sorted(((k, v) for k, v in convs.items() if k[0] is None), key=lambda kv: kv[0][1])
+    ids = {}
+
+    if owned:
+        rows = await tx.fetchall("""
+            INSERT INTO conversations (user_id, wa_id, name, last_message_text, last_message_at, unread_count)
+            SELECT t.user_id, t.wa_id, t.wa_id, t.text, TO_TIMESTAMP(t.ts), t.n
+            FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::bigint[], %s::int[])
+                 AS t(user_id, wa_id, text, ts, n)
+            ON CONFLICT (user_id, wa_id) DO UPDATE
+            SET last_message_text = EXCLUDED.last_message_text,
+                last_message_at = EXCLUDED.last_message_at,
+                unread_count = conversations.unread_count + EXCLUDED.unread_count,
+                updated_at = clock_timestamp()
+            RETURNING id, user_id, wa_id, name, last_message_text, last_message_at, unread_count, created_at
+        """, (
+            [k[0] for k, _ in owned],
+            [k[1] for k, _ in owned],
+            [v["text"] for _, v in owned],
+            [v["ts"] for _, v in owned],
+            [v["count"] for _, v in owned],
+        ))
+        for row in rows:
+            ids[(str(row["user_id"]), row["wa_id"])] = row
+
+    if orphan:
+        # sem dono (phone_number_id desconhecido): user_id NULL não entra no índice único
+        rows = await tx.fetchall("""
+            WITH t AS (
+                SELECT * FROM unnest(%s::text[], %s::text[], %s::bigint[], %s::int[]) AS t(wa_id, text, ts, n)
+            ),
+            upd AS (
+                UPDATE conversations AS c
+                SET last_message_text = t.text,
+                    last_message_at = TO_TIMESTAMP(t.ts),
+                    unread_count = c.unread_count + t.n,
+                    updated_at = clock_timestamp()
+                FROM t
+                WHERE c.user_id IS NULL AND c.wa_id = t.wa_id
+                RETURNING c.id, c.wa_id
+            ),
+            ins AS (
+                INSERT INTO conversations (user_id, wa_id, name, last_message_text, last_message_at, unread_count)
+                SELECT NULL, t.wa_id, t.wa_id, t.text, TO_TIMESTAMP(t.ts), t.n
+                FROM t
+                WHERE NOT EXISTS (SELECT 1 FROM upd WHERE upd.wa_id = t.wa_id)
+                RETURNING id, wa_id
+            )
+            SELECT id, wa_id FROM upd
+            UNION ALL
+            SELECT id, wa_id FROM ins
+        """, (
+            [k[1] for k, _ in orphan],
+            [v["text"] for _, v in orphan],
+            [v["ts"] for _, v in orphan],
+            [v["count"] for _, v in orphan],
+        ))
+        for row in rows:
+            ids[(None, row["wa_id"])] = row
+
+    return ids
+
+
+def _phone_number_ids(payloads: List[dict]) -> List[Optional[str]]:
+    return [m["phone_number_id"] for payload in payloads for m in parse_incoming_messages(payload)]
+
+
+async def resolve_owners(payloads: List[dict]) -> Dict[str, str]:
+    """phone_number_id -> user_id dos payloads. Chamar ANTES de abrir a transação."""
+    return await routing_table.resolve(_phone_number_ids(payloads))
+
+
+def cached_owners(payloads: List[dict]) -> Dict[str, str]:
+    """Como resolve_owners, sem recarregar a tabela (pode ser usado com transação aberta)."""
+    return routing_table.lookup(_phone_number_ids(payloads))
+
+
+async def ingest_payloads_tx(tx, payloads: List[dict], owners: Dict[str, str]) -> int:
+    """
+    Igual a ingest_webhook_payloads, mas dentro de uma transação já aberta.
+
+    owners: phone_number_id -> user_id (resolve_owners), resolvido fora da
+    transação para não abrir uma segunda conexão no meio dela.
+    """
+    statuses = [st for payload in payloads for st in parse_statuses(payload)]
+    if statuses:
+        await apply_statuses(tx, statuses)
+
+    messages = [m for payload in payloads for m in parse_incoming_messages(payload) if m["wa_id"]]
+    if not messages:
+        return 0
+
+    for m in messages:
+        m["user_id"] = owners.get(m["phone_number_id"])
+
+    conversations = await _upsert_conversations(tx, _aggregate(messages))
+
+    inserted = await tx.fetchall("""
+        INSERT INTO messages (
+            conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp
+        )
+        SELECT t.conversation_id, 'incoming', 'text', t.text, t.wa_id, 'received', NULL, TO_TIMESTAMP(t.ts)
+        FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::bigint[]) AS t(conversation_id, text, wa_id, ts)
+        RETURNING id, conversation_id, direction, type, text, wa_id, status, meta_message_id, timestamp, created_at
+    """, (
+        [str(conversations[(m["user_id"], m["wa_id"])]["id"]) for m in messages],
+        [m["text"] for m in messages],
+        [m["wa_id"] for m in messages],
+        [m["ts"] for m in messages],
+    ))
+
+    # tempo real: só conversas com dono (user_id)
+    conv_owner = {str(c["id"]): key[0] for key, c in conversations.items() if key[0]}
+    for msg in inserted:
+        publish(tx, conv_owner.get(str(msg["conversation_id"])), "message.new", msg)
+    for (user_id, _), conv in conversations.items():
+        publish(tx, user_id, "conversation.updated", conv)
+
+    return len(messages)
+
+
+async def ingest_webhook_payloads(payloads: List[dict]) -> int:
+    """Grava as mensagens recebidas de um ou mais payloads. Retorna quantas foram gravadas."""
+    owners = await resolve_owners(payloads)
+    async with transaction() as tx:
+        return await ingest_payloads_tx(tx, payloads, owners)
@@ -0,0 +1,304 @@
+"""
+Worker de campanhas.
+
+A fila é a própria tabela campaign_items: cada worker "aluga" um lote de itens
+com SELECT ... FOR UPDATE SKIP LOCKED (status 'processing' + locked_until),
+renova o aluguel enquanto envia e grava o resultado. Se o processo morrer, o
+aluguel expira e outro worker retoma os itens.
+
+Nada é enviado duas vezes: item retomado (o worker anterior pode ter enviado
+antes de cair) e envio com timeout ficam 'unknown' até o webhook de status
+confirmar (viram 'sent') ou STATUS_BACKLOG_MAX_AGE passar sem status (viram
+'failed', sem reenvio).
+
+Rodar separado do web (quantos processos/máquinas quiser):
+
+    python -m app.worker
+
+Obs: o rate limit (META_MESSAGES_PER_SECOND) é por processo; com N workers
+enviando pelo mesmo número, configure o limite dividido por N.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+
+from prometheus_client import start_http_server
+
+from .db import transaction, open_db, close_db
+from .dispatcher import dispatch
+from .campaign_results import CampaignResultBuffer, flush_all_results
+from .meta_client import (
+    CompiledTemplate, MetaSendError, send_compiled_template, send_whatsapp_text, start_meta_client, close_meta_client,
+)
+from .schema import ensure_schema
+from .events import publish
+from .metrics import METRICS_ADDR, METRICS_ENABLED
+from .statuses import CAMPAIGN_PROGRESS_COLUMNS, STATUS_BACKLOG_MAX_AGE, purge_status_backlog
+
+CAMPAIGN_CLAIM_BATCH = int(os.getenv("CAMPAIGN_CLAIM_BATCH", "200"))
+CAMPAIGN_LEASE_SECONDS = float(os.getenv("CAMPAIGN_LEASE_SECONDS", "60"))
+CAMPAIGN_MAX_ATTEMPTS = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "3"))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+STATUS_BACKLOG_PURGE_INTERVAL = float(os.getenv("STATUS_BACKLOG_PURGE_INTERVAL", "600"))
+# worker separado: porta própria para o Prometheus coletar (0 = desligado; interface em METRICS_ADDR)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+logger = logging.getLogger(__name__)
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def claim_items(campaign_id, worker_id: str, limit: int = CAMPAIGN_CLAIM_BATCH):
+    """Aluga até `limit` itens pendentes (ou com aluguel vencido) da campanha."""
+    async with transaction() as tx:
+        return await tx.fetchall("""
+            WITH claimed AS (
+                SELECT id
+                FROM campaign_items
+                WHERE campaign_id = %s
+                  AND (
+                        status = 'pending'
+                        OR (status = 'processing' AND locked_until < NOW() AND attempts < %s)
+                      )
+                ORDER BY created_at ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE campaign_items AS ci
+            SET status = 'processing',
+                locked_by = %s,
+                locked_until = NOW() + make_interval(secs => %s),
+                attempts = ci.attempts + 1
+            FROM claimed
+            WHERE ci.id = claimed.id
+            RETURNING ci.id, ci."to", ci.params, ci.attempts
+        """, (campaign_id, CAMPAIGN_MAX_ATTEMPTS, limit, worker_id, CAMPAIGN_LEASE_SECONDS))
+
+
+async def _heartbeat(worker_id: str):
+    # renova o aluguel dos itens deste worker enquanto o lote está sendo enviado
+    while True:
+        await asyncio.sleep(CAMPAIGN_LEASE_SECONDS / 3)
+        try:
+            async with transaction() as tx:
+                await tx.execute("""
+                    UPDATE campaign_items
+                    SET locked_until = NOW() + make_interval(secs => %s)
+                    WHERE locked_by = %s AND status = 'processing'
+                """, (CAMPAIGN_LEASE_SECONDS, worker_id))
+        except Exception:
+            logger.exception("Falha ao renovar aluguel dos itens (worker %s)", worker_id)
+
+
+async def fail_abandoned_items():
+    """Itens que já estouraram as tentativas e ficaram órfãos viram 'failed'."""
+    async with transaction() as tx:
+        await tx.execute("""
+            WITH dead AS (
+                UPDATE campaign_items
+                SET status = 'failed',
+                    error_message = 'Envio interrompido (worker caiu) após várias tentativas',
+                    locked_by = NULL,
+                    locked_until = NULL
+                WHERE status = 'processing'
+                  AND locked_until < NOW()
+                  AND attempts >= %s
+                RETURNING campaign_id
+            )
+            UPDATE campaigns AS c
+            SET failed = c.failed + d.n
+            FROM (SELECT campaign_id, COUNT(*) AS n FROM dead GROUP BY campaign_id) AS d
+            WHERE c.id = d.campaign_id
+        """, (CAMPAIGN_MAX_ATTEMPTS,))
+
+
+async def expire_unknown_items():
+    """Envios incertos sem nenhum status da Meta dentro do prazo viram 'failed' (não são reenviados)."""
+    async with transaction() as tx:
+        await tx.execute("""
+            WITH expired AS (
+                UPDATE campaign_items
+                SET status = 'failed',
+                    error_message = 'Envio não confirmado pela Meta; não reenviado para evitar duplicidade'
+                        || COALESCE(' (' || error_message || ')', ''),
+                    unknown_since = NULL
+                WHERE status = 'unknown'
+                  AND unknown_since < NOW() - make_interval(secs => %s)
+                RETURNING campaign_id
+            )
+            UPDATE campaigns AS c
+            SET failed = c.failed + e.n
+            FROM (SELECT campaign_id, COUNT(*) AS n FROM expired GROUP BY campaign_id) AS e
+            WHERE c.id = e.campaign_id
+        """, (STATUS_BACKLOG_MAX_AGE,))
+
+
+async def finish_if_done(campaign_id):
+    async with transaction() as tx:
+        camp = await tx.fetchone(f"""
+            UPDATE campaigns
+            SET status = 'finished'
+            WHERE id = %s
+              AND status IN ('pending', 'running')
+              AND NOT EXISTS (
+                  SELECT 1 FROM campaign_items
+                  WHERE campaign_id = %s AND status IN ('pending', 'processing')
+              )
+            RETURNING {CAMPAIGN_PROGRESS_COLUMNS}
+        """, (campaign_id, campaign_id))
+        if camp:
+            publish(tx, camp["user_id"], "campaign.progress", camp)
+
+
+async def process_campaign_batch(camp: dict, worker_id: str) -> bool:
+    """Envia um lote da campanha. Retorna False se não havia nada para este worker."""
+    campaign_id = camp["id"]
+
+    items = await claim_items(campaign_id, worker_id)
+    if not items:
+        await finish_if_done(campaign_id)
+        return False
+
+    if camp["status"] == "pending":
+        async with transaction() as tx:
+            running = await tx.fetchone(f"""
+                UPDATE campaigns SET status='running'
+                WHERE id=%s AND status='pending'
+                RETURNING {CAMPAIGN_PROGRESS_COLUMNS}
+            """, (campaign_id,))
+            if running:
+                publish(tx, running["user_id"], "campaign.progress", running)
+
+    template_name = camp.get("template_name")
+    template_language_code = camp.get("template_language_code") or "pt_BR"
+    template_body_params = camp.get("template_body_params")
+    message_text = camp.get("message_text")
+    phone_number_id = camp.get("phone_number_id")
+
+    # JSON do template montado uma vez; por envio só entram o "to" e os parâmetros
+    compiled = None
+    if template_name:
+        compiled = CompiledTemplate(template_name, template_language_code, template_body_params)
+
+    async def send(item):
+        if compiled is not None:
+            return await send_compiled_template(
+                compiled,
+                to=item["to"],
+                phone_number_id=phone_number_id,
+                # parâmetros do próprio contato (upload CSV) ou os da campanha
+                body_params=item.get("params"),
+                callback_data=str(item["id"]),
+            )
+        return await send_whatsapp_text(
+            to=item["to"],
+            text=message_text,
+            phone_number_id=phone_number_id,
+            callback_data=str(item["id"]),
+        )
+
+    # retomados de um worker que caiu: o envio pode já ter saído, então não reenvia
+    # (o id do item vai como biz_opaque_callback_data e o status da Meta resolve)
+    resumed = [item for item in items if item.get("attempts", 1) > 1]
+    fresh = [item for item in items if item.get("attempts", 1) <= 1]
+
+    heartbeat = asyncio.create_task(_heartbeat(worker_id))
+    try:
+        # resultados vão para o banco em lote (ver CampaignResultBuffer)
+        async with CampaignResultBuffer(campaign_id, worker_id) as results:
+            for item in resumed:
+                await results.add_unknown(item["id"], "Envio interrompido (worker caiu); aguardando status da Meta")
+
+            async def on_result(item, meta_id, error):
+                if error is None:
+                    await results.add(item["id"], meta_id, None)
+                elif isinstance(error, MetaSendError) and error.kind == MetaSendError.AMBIGUOUS:
+                    await results.add_unknown(item["id"], str(error))
+                else:
+                    await results.add(item["id"], None, str(error))
+
+            if fresh:
+                await dispatch(fresh, send, on_result, phone_number_id)
+    finally:
+        heartbeat.cancel()
+
+    await finish_if_done(campaign_id)
+    return True
+
+
+async def run_worker(stop: asyncio.Event, worker_id: str = None):
+    """
+    Loop principal: percorre as campanhas ativas e envia lote a lote até `stop`.
+    Campanhas 'running' de um processo que caiu são retomadas aqui mesmo.
+    """
+    worker_id = worker_id or new_worker_id()
+    logger.info("Worker de campanhas iniciado (%s)", worker_id)
+
+    last_purge = 0.0
+    while not stop.is_set():
+        did_work = False
+        try:
+            await fail_abandoned_items()
+            await expire_unknown_items()
+
+            if time.monotonic() - last_purge > STATUS_BACKLOG_PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                async with transaction() as tx:
+                    await purge_status_backlog(tx)
+
+            async with transaction() as tx:
+                campaigns = await tx.fetchall("""
+                    SELECT *
+                    FROM campaigns
+                    WHERE status IN ('pending', 'running')
+                    ORDER BY created_at ASC
+                """)
+
+            for camp in campaigns:
+                if stop.is_set():
+                    break
+                if await process_campaign_batch(camp, worker_id):
+                    did_work = True
+        except Exception:
+            logger.exception("Erro no loop do worker %s", worker_id)
+
+        if not did_work:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=WORKER_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    logger.info("Worker de campanhas parado (%s)", worker_id)
+
+
+async def main():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    await open_db()
+    await ensure_schema()
+    await start_meta_client()
+    if METRICS_PORT and METRICS_ENABLED:
+        start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+    try:
+        await run_worker(stop)
+    finally:
+        await flush_all_results()
+        await close_meta_client()
+        await close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+"""
+Graph API falsa para testes de carga (sem falar com a Meta de verdade).
+
+Responde POST /<versão>/<phone_number_id>/messages como a Cloud API, com
+latência, erros e limite de taxa configuráveis:
+
+    python -m bench.fake_meta --port 8900 --latency 80 --jitter 40 \\
+        --error-rate 0.01 --rate-limit 80
+
+e o app/worker apontando para ela:
+
+    META_BASE_URL=http://127.0.0.1:8900/v21.0 META_ACCESS_TOKEN=bench python -m app.worker
+
+GET /stats devolve os contadores (enviadas, erros, 429).
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeMetaConfig:
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 20.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0):
+        self.latency_ms = latency_ms    # latência média de cada envio
+        self.jitter_ms = jitter_ms      # +- aleatório em cima da média
+        self.error_rate = error_rate    # fração de envios que devolvem 500 (código 131000)
+        self.rate_limit = rate_limit    # msgs/s por phone_number_id (0 = sem limite); acima disso 429
+
+
+def create_app(config: FakeMetaConfig) -> FastAPI:
+    app = FastAPI(title="Graph API falsa")
+    started_at = time.monotonic()
+    stats = {"sent": 0, "errors": 0, "throttled": 0}
+    windows: Dict[str, List[int]] = {}  # phone_number_id -> [segundo, envios nesse segundo]
+
+    def _error(status_code: int, code: int, message: str, headers=None):
+        return JSONResponse(
+            {"error": {"message": message, "type": "OAuthException", "code": code}},
+            status_code=status_code,
+            headers=headers,
+        )
+
+    @app.post("/{version}/{phone_number_id}/messages")
+    async def send_message(version: str, phone_number_id: str, request: Request):
+        body = await request.json()
+
+        if config.rate_limit > 0:
+            now = int(time.monotonic())
+            window = windows.setdefault(phone_number_id, [now, 0])
+            if window[0] != now:
+                window[0], window[1] = now, 0
+            window[1] += 1
+            if window[1] > config.rate_limit:
+                stats["throttled"] += 1
+                return _error(429, 130429, "Rate limit hit", {"Retry-After": "1"})
+
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if config.error_rate and random.random() < config.error_rate:
+            stats["errors"] += 1
+            return _error(500, 131000, "Something went wrong")
+
+        stats["sent"] += 1
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": body.get("to"), "wa_id": body.get("to")}],
+            "messages": [{"id": f"wamid.fake.{uuid.uuid4().hex}"}],
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        elapsed = time.monotonic() - started_at
+        return {**stats, "sent_per_second": round(stats["sent"] / elapsed, 1) if elapsed else 0.0}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=50.0, help="latência média (ms)")
+    parser.add_argument("--jitter", type=float, default=20.0, help="variação da latência (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de respostas 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="msgs/s por phone_number_id (0 = sem limite)")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = FakeMetaConfig(args.latency, args.jitter, args.error_rate, args.rate_limit)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
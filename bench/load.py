@@ -0,0 +1,305 @@
+"""
+Benchmark de ponta a ponta contra um Postgres local, sem a Meta de verdade.
+
+Sobe a Graph API falsa (bench/fake_meta.py) numa thread, aponta o
+meta_client para ela (META_BASE_URL) e roda o app no próprio processo:
+
+    DATABASE_URL=postgresql://localhost/painel_bench python -m bench.load \\
+        --scenarios webhook,text,campaign,statuses --n 2000 --concurrency 50
+
+Cenários:
+    webhook   POST /webhook/meta (mensagens recebidas) até tudo estar gravado
+    text      POST /api/messages/text nas conversas criadas
+    campaign  campanha de template com --n contatos enviada pelo worker
+    statuses  webhooks de status (delivered/read) das mensagens da campanha
+
+Para cada cenário: ops/s, latência p50/p99 e idas ao banco (queries e
+transações) por operação. O rate limit por número continua valendo
+(META_MESSAGES_PER_SECOND); aumente-o para medir só o app.
+
+ATENÇÃO: grava usuário, conversas e campanhas de teste no banco apontado.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from typing import List
+
+from .report import print_table, summarize
+from .webhook_load import build_payload, contact_numbers, run_webhook_load, signed_headers
+
+# antes de importar o app: worker controlado aqui e Meta local
+os.environ.setdefault("CAMPAIGN_WORKER_EMBEDDED", "false")
+os.environ.setdefault("META_ACCESS_TOKEN", "bench")
+
+BENCH_EMAIL = "bench@painel.com"
+BENCH_PASSWORD = "bench-123456"
+BENCH_PHONE_NUMBER_ID = "100000000000001"
+
+
+class DbCounter:
+    """Conta queries e transações (instrumenta AsyncTx/ThreadedTx do app.db)."""
+
+    def __init__(self):
+        self.queries = 0
+        self.transactions = 0
+
+    def install(self):
+        from app import db
+
+        for cls in (db.AsyncTx, db.ThreadedTx):
+            for name in ("execute", "fetchone", "fetchall", "copy_rows"):
+                setattr(cls, name, self._count_query(getattr(cls, name)))
+            cls.__init__ = self._count_tx(cls.__init__)
+
+    def _count_query(self, method):
+        async def wrapper(tx, *args, **kwargs):
+            self.queries += 1
+            return await method(tx, *args, **kwargs)
+        return wrapper
+
+    def _count_tx(self, init):
+        def wrapper(tx, *args, **kwargs):
+            self.transactions += 1
+            init(tx, *args, **kwargs)
+        return wrapper
+
+    def snapshot(self):
+        return self.queries, self.transactions
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_meta(args) -> str:
+    """Graph API falsa numa thread (uvicorn próprio). Retorna a base URL."""
+    import uvicorn
+
+    from .fake_meta import FakeMetaConfig, create_app
+
+    port = _free_port()
+    config = FakeMetaConfig(args.latency, args.jitter, args.error_rate, args.rate_limit)
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v21.0"
+
+
+async def _wait_ingested(target: int, timeout: float):
+    from app import ingest_queue
+
+    deadline = time.monotonic() + timeout
+    while ingest_queue.stats()["payloads_ingested"] < target:
+        if time.monotonic() > deadline:
+            raise TimeoutError("webhooks não foram gravados a tempo")
+        await asyncio.sleep(0.02)
+
+
+async def bench_webhook(client, counter, args, wa_ids) -> dict:
+    from app import ingest_queue
+
+    target = ingest_queue.stats()["payloads_ingested"] + args.n
+    q0, t0 = counter.snapshot()
+    start = time.perf_counter()
+    _, latencies, errors = await run_webhook_load(
+        client, "/webhook/meta", args.n, args.concurrency, BENCH_PHONE_NUMBER_ID, wa_ids,
+        secret=os.getenv("META_APP_SECRET"),
+    )
+    await _wait_ingested(target, args.timeout)
+    elapsed = time.perf_counter() - start
+    q1, t1 = counter.snapshot()
+    if errors:
+        print(f"webhook: {errors} respostas com erro")
+    return summarize("webhook", args.n, elapsed, latencies, q1 - q0, t1 - t0)
+
+
+async def bench_text(client, counter, args, headers, wa_ids) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(args.n))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            body = {"phone_number_id": BENCH_PHONE_NUMBER_ID, "to": wa_ids[i % len(wa_ids)], "message": f"teste {i}"}
+            start = time.perf_counter()
+            r = await client.post("/api/messages/text", json=body, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            if r.status_code != 200:
+                errors += 1
+
+    q0, t0 = counter.snapshot()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    q1, t1 = counter.snapshot()
+    if errors:
+        print(f"text: {errors} respostas com erro")
+    return summarize("text", args.n, elapsed, latencies, q1 - q0, t1 - t0)
+
+
+async def bench_campaign(client, counter, args, headers):
+    from app import worker
+    from app.db import transaction
+
+    numbers = [f"5521{900000000 + i}" for i in range(args.n)]
+    r = await client.post("/api/campaigns", headers=headers, json={
+        "name": f"bench {time.strftime('%H:%M:%S')}",
+        "phone_number_id": BENCH_PHONE_NUMBER_ID,
+        "template_name": "bench_template",
+        "template_body_params": ["Fulano", "R$ 10,00"],
+        "to_numbers": numbers,
+    })
+    r.raise_for_status()
+    campaign_id = r.json()["campaign_id"]
+
+    # latência de cada envio (chamada à Meta com retentativas) medida em volta do cliente
+    latencies: List[float] = []
+    send = worker.send_compiled_template
+
+    async def timed_send(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return await send(*a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    worker.send_compiled_template = timed_send
+    stop = asyncio.Event()
+    q0, t0 = counter.snapshot()
+    start = time.perf_counter()
+    task = asyncio.create_task(worker.run_worker(stop, "bench"))
+    polls = 0
+    try:
+        deadline = time.monotonic() + args.timeout
+        while True:
+            polls += 1  # 1 transação + 1 query do próprio benchmark, descontadas abaixo
+            async with transaction() as tx:
+                camp = await tx.fetchone("SELECT status FROM campaigns WHERE id=%s", (campaign_id,))
+            if camp["status"] == "finished":
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError("campanha não terminou a tempo")
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        q1, t1 = counter.snapshot()
+    finally:
+        stop.set()
+        await task
+        worker.send_compiled_template = send
+
+    return summarize("campaign", args.n, elapsed, latencies, q1 - q0 - polls, t1 - t0 - polls), campaign_id
+
+
+async def bench_statuses(client, counter, args, campaign_id) -> dict:
+    from app import ingest_queue
+    from app.db import transaction
+
+    async with transaction() as tx:
+        rows = await tx.fetchall(
+            "SELECT meta_message_id FROM campaign_items WHERE campaign_id=%s AND meta_message_id IS NOT NULL",
+            (campaign_id,),
+        )
+    meta_ids = [row["meta_message_id"] for row in rows]
+    per_payload = max(1, args.statuses_per_payload)
+    batches = [meta_ids[i:i + per_payload] for i in range(0, len(meta_ids), per_payload)]
+    latencies: List[float] = []
+    remaining = iter(batches)
+    secret = os.getenv("META_APP_SECRET")
+
+    async def worker():
+        for ids in remaining:
+            payload = build_payload(BENCH_PHONE_NUMBER_ID, [], messages=0, status_ids=ids)
+            raw = json.dumps(payload).encode()
+            start = time.perf_counter()
+            await client.post("/webhook/meta", content=raw, headers=signed_headers(raw, secret))
+            latencies.append(time.perf_counter() - start)
+
+    target = ingest_queue.stats()["payloads_ingested"] + len(batches)
+    q0, t0 = counter.snapshot()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    await _wait_ingested(target, args.timeout)
+    elapsed = time.perf_counter() - start
+    q1, t1 = counter.snapshot()
+    return summarize("statuses", len(meta_ids), elapsed, latencies, q1 - q0, t1 - t0)
+
+
+async def _run(args):
+    import httpx
+
+    from app import main as app_main
+    from app.webhook import ingest_webhook_payloads
+
+    counter = DbCounter()
+    counter.install()
+    rows = []
+
+    app = app_main.app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            seed = await client.post("/api/auth/seed-admin", params={
+                "secret": os.getenv("SEED_SECRET", "seed-local"),
+                "email": BENCH_EMAIL,
+                "password": BENCH_PASSWORD,
+                "phone_number_id": BENCH_PHONE_NUMBER_ID,
+            })
+            seed.raise_for_status()
+            login = await client.post("/api/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+            login.raise_for_status()
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+            # conversas para o cenário text (e destino das mensagens do webhook)
+            wa_ids = contact_numbers(args.contacts)
+            await ingest_webhook_payloads([build_payload(BENCH_PHONE_NUMBER_ID, [w]) for w in wa_ids])
+
+            campaign_id = None
+            for scenario in args.scenarios:
+                if scenario == "webhook":
+                    rows.append(await bench_webhook(client, counter, args, wa_ids))
+                elif scenario == "text":
+                    rows.append(await bench_text(client, counter, args, headers, wa_ids))
+                elif scenario == "campaign":
+                    row, campaign_id = await bench_campaign(client, counter, args, headers)
+                    rows.append(row)
+                elif scenario == "statuses":
+                    if campaign_id is None:
+                        print("statuses: rode depois de campaign (--scenarios campaign,statuses)")
+                        continue
+                    rows.append(await bench_statuses(client, counter, args, campaign_id))
+                else:
+                    print(f"cenário desconhecido: {scenario}")
+
+    print_table(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="webhook,text,campaign,statuses",
+                        type=lambda s: [x.strip() for x in s.split(",") if x.strip()])
+    parser.add_argument("--n", type=int, default=1000, help="operações por cenário")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--contacts", type=int, default=200, help="conversas usadas pelos cenários webhook/text")
+    parser.add_argument("--statuses-per-payload", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=300, help="limite por cenário (s)")
+    parser.add_argument("--meta-url", help="Graph API já rodando (senão sobe bench/fake_meta.py)")
+    parser.add_argument("--latency", type=float, default=50.0, help="latência da Meta falsa (ms)")
+    parser.add_argument("--jitter", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="msgs/s por número na Meta falsa")
+    args = parser.parse_args()
+
+    os.environ["META_BASE_URL"] = args.meta_url or start_fake_meta(args)
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
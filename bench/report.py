@@ -0,0 +1,34 @@
+"""Percentis e a tabela de resultados dos benchmarks."""
+from typing import List, Optional, Sequence
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(name: str, ops: int, elapsed: float, latencies: List[float],
+              queries: Optional[int] = None, transactions: Optional[int] = None) -> dict:
+    """Uma linha do relatório (latências em segundos, saída em ms)."""
+    return {
+        "cenário": name,
+        "ops": ops,
+        "ops/s": round(ops / elapsed, 1) if elapsed else 0.0,
+        "p50 ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99 ms": round(percentile(latencies, 99) * 1000, 1),
+        "queries/op": round(queries / ops, 2) if queries is not None and ops else "-",
+        "tx/op": round(transactions / ops, 2) if transactions is not None and ops else "-",
+    }
+
+
+def print_table(rows: List[dict]):
+    if not rows:
+        return
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark da montagem do payload de template (CPU por envio).
+
+Compara o caminho antigo (dict novo + json.dumps a cada destinatário) com o
+CompiledTemplate (JSON pré-serializado, só o "to" é encaixado):
+
+    python -m bench.template_payload [--n 200000] [--params 3]
+"""
+import argparse
+import json
+import time
+
+from app.meta_client import ORJSON_AVAILABLE, CompiledTemplate
+
+
+def legacy_payload(to, template_name, language_code, body_params):
+    # como send_whatsapp_template montava o payload antes da pré-compilação
+    components = []
+    if body_params:
+        components.append({
+            "type": "body",
+            "parameters": [{"type": "text", "text": param} for param in body_params],
+        })
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": "template",
+        "template": {"name": template_name, "language": {"code": language_code}},
+    }
+    if components:
+        payload["template"]["components"] = components
+    # httpx(json=...) serializa com json.dumps
+    return json.dumps(payload).encode()
+
+
+def _timeit(fn, recipients) -> float:
+    start = time.perf_counter()
+    for to in recipients:
+        fn(to)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=200_000, help="envios simulados")
+    parser.add_argument("--params", type=int, default=3, help="parâmetros do corpo do template")
+    args = parser.parse_args()
+
+    name, lang = "promo_black_friday", "pt_BR"
+    params = [f"valor {i} com acentuação" for i in range(1, args.params + 1)]
+    recipients = [f"55119{i:08d}" for i in range(args.n)]
+
+    compiled = CompiledTemplate(name, lang, params)
+    # mesmo conteúdo nos dois caminhos
+    assert json.loads(compiled.render(recipients[0])) == json.loads(legacy_payload(recipients[0], name, lang, params))
+
+    legacy = _timeit(lambda to: legacy_payload(to, name, lang, params), recipients)
+    fast = _timeit(compiled.render, recipients)
+    per_contact = _timeit(lambda to: compiled.render(to, [to, "x"]), recipients)
+
+    print(f"orjson: {'sim' if ORJSON_AVAILABLE else 'não'} | envios: {args.n} | parâmetros: {args.params}")
+    for label, secs in (
+        ("dict + json.dumps (antigo)", legacy),
+        ("CompiledTemplate", fast),
+        ("CompiledTemplate (params por contato)", per_contact),
+    ):
+        print(f"  {label:<40} {secs * 1e6 / args.n:7.2f} µs/envio  ({legacy / secs:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
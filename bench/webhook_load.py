@@ -0,0 +1,111 @@
+"""
+Gerador de tráfego de webhook (mensagens recebidas e status de entrega).
+
+Manda payloads no formato da Meta para o POST /webhook/meta de um servidor
+rodando e mede a latência do endpoint:
+
+    python -m bench.webhook_load --url http://127.0.0.1:8000/webhook/meta \\
+        --phone-number-id 123 --n 5000 --concurrency 50 --contacts 500
+
+Com META_APP_SECRET no ambiente os payloads vão assinados (X-Hub-Signature-256).
+O atraso até gravar no banco aparece em GET /api/admin/webhook-stats (token de admin).
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+from typing import List, Optional, Tuple
+
+import httpx
+
+from .report import print_table, summarize
+
+
+def contact_numbers(contacts: int) -> List[str]:
+    return [f"5511{900000000 + i}" for i in range(contacts)]
+
+
+def build_payload(phone_number_id: str, wa_ids: List[str], messages: int = 1,
+                  status_ids: Optional[List[str]] = None) -> dict:
+    """Payload de webhook com `messages` mensagens recebidas (e status, se houver)."""
+    now = int(time.time())
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"phone_number_id": phone_number_id},
+        "messages": [
+            {
+                "from": random.choice(wa_ids),
+                "id": f"wamid.bench.{now}.{random.getrandbits(48):x}",
+                "timestamp": str(now),
+                "type": "text",
+                "text": {"body": "mensagem de teste de carga"},
+            }
+            for _ in range(messages)
+        ],
+    }
+    if status_ids:
+        value["statuses"] = [
+            {"id": meta_id, "status": random.choice(("delivered", "read")), "timestamp": str(now)}
+            for meta_id in status_ids
+        ]
+    return {"object": "whatsapp_business_account", "entry": [{"id": "bench", "changes": [{"field": "messages", "value": value}]}]}
+
+
+def signed_headers(raw: bytes, secret: Optional[str]) -> dict:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Hub-Signature-256"] = "sha256=" + hmac.new(secret.encode(), raw, hashlib.sha256).hexdigest()
+    return headers
+
+
+async def run_webhook_load(client: httpx.AsyncClient, url: str, n: int, concurrency: int,
+                           phone_number_id: str, wa_ids: List[str], messages: int = 1,
+                           secret: Optional[str] = None) -> Tuple[float, List[float], int]:
+    """Manda `n` webhooks com `concurrency` em paralelo. Retorna (tempo, latências, erros)."""
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(n))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            raw = json.dumps(build_payload(phone_number_id, wa_ids, messages)).encode()
+            start = time.perf_counter()
+            r = await client.post(url, content=raw, headers=signed_headers(raw, secret))
+            latencies.append(time.perf_counter() - start)
+            if r.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return time.perf_counter() - start, latencies, errors
+
+
+async def _main(args):
+    async with httpx.AsyncClient(timeout=30) as client:
+        elapsed, latencies, errors = await run_webhook_load(
+            client, args.url, args.n, args.concurrency, args.phone_number_id,
+            contact_numbers(args.contacts), args.messages, os.getenv("META_APP_SECRET"),
+        )
+    print_table([summarize("webhook (HTTP)", args.n, elapsed, latencies)])
+    if errors:
+        print(f"respostas com erro: {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/webhook/meta")
+    parser.add_argument("--phone-number-id", required=True)
+    parser.add_argument("--n", type=int, default=2000, help="webhooks enviados")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--contacts", type=int, default=500, help="wa_ids distintos")
+    parser.add_argument("--messages", type=int, default=1, help="mensagens por payload")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()